@@ -1,11 +1,54 @@
+import random
+import struct
 import pytest
 from tlm_app import create_app
 from tlm_app.database import init_db
+from tlm_app.ip import DATA_OFF, PACKET_SIZE
+
+CU_IP = "255.255.255.255"
+LTU_IPS = ["172.16.1.11", "172.16.1.21", "172.16.1.31"]
+UNKNOWN_IP = "10.0.0.1"
+
+
+def make_packet(ip, cutime=0, sub_type=0, t_on=0, rng=None):
+    packet = bytearray(PACKET_SIZE)
+    struct.pack_into(">H", packet, 12, 0x0800)
+    struct.pack_into(">BxH", packet, 14, 0x45, PACKET_SIZE - 14)
+    packet[23] = 17
+    packet[26:30] = bytes(int(x) for x in ip.split("."))
+    struct.pack_into(">H", packet, 38, PACKET_SIZE - 34)
+    struct.pack_into("<H", packet, DATA_OFF + 8, sub_type)
+    struct.pack_into("<Q", packet, DATA_OFF + 44, cutime)
+    if t_on:
+        struct.pack_into("<I", packet, DATA_OFF + 158, t_on)
+    elif rng is not None:
+        packet[DATA_OFF + 72: DATA_OFF + 176] = rng.randbytes(104)
+    return bytes(packet)
+
+
+def make_trace(routes=(280_000_000, 280_086_400), per_route=30, seed=0):
+    rng = random.Random(seed)
+    packets = [make_packet(LTU_IPS[0], 1, rng=rng)]
+    tick = 10**9
+    for t_on in routes:
+        packets.append(make_packet(CU_IP, tick, sub_type=1, t_on=t_on))
+        for num in range(per_route):
+            tick += 125_000_000 + rng.randrange(1000)
+            ip = LTU_IPS[num % 3] if num % 7 else UNKNOWN_IP
+            packets.append(make_packet(ip, tick, rng=rng))
+    return b"".join(packets)
 
 
 @pytest.fixture()
-def app():
-    app = create_app()
+def app(tmp_path):
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'ltu-tel.sqlite'}",
+            "UPLOAD_FOLDER": str(tmp_path / "uploads"),
+            "TLM_COLUMNAR_FOLDER": str(tmp_path / "columns"),
+            "TLM_PLOT_FOLDER": str(tmp_path / "plots"),
+        }
+    )
     app.config.update(
         {
             "TESTING": True,
@@ -21,3 +64,15 @@ def app():
 @pytest.fixture()
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture()
+def trace():
+    return make_trace()
+
+
+@pytest.fixture()
+def trace_path(tmp_path, trace):
+    path = tmp_path / "trace.tld"
+    path.write_bytes(trace)
+    return str(path)
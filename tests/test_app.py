@@ -1,4 +1,35 @@
-from tlm_app import create_app
+import csv
+import io
+import json
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from tests.conftest import make_trace
+from tlm_app import create_app, render, rollup as rollups
+from tlm_app.cache import DataGeneration, ResultCache, get_cache
+from tlm_app.database import db, bulk_profile, init_db
+from tlm_app.decimate import decimate
+from tlm_app.layout import ROW_BUILDERS
+from tlm_app.models import Adjustment, Telemetry, generation, rollup
+from tlm_app.render import Renderer
+from tlm_app.rollup import choose_level, collect_rollup
+from tlm_app.packet import get_telemetry
+from tlm_app.pages import decode_cursor, table_page
+from tlm_app.store import data_statement, get_store, routes_statement
+from tlm_app.timestamp import epoch_ns_to_local
+from tlm_app.plot import (
+    channel_id_by_name,
+    collect_columns,
+    collect_series,
+    columnar_series,
+    PLOT_WIDTH,
+    view_routes,
+)
 
 
 def test_config():
@@ -19,11 +50,553 @@ def test_upload(client):
     client.post("/upload")
 
 
-def test_table(client):
-    response = client.get("/table?channel=LTU1.1&set=brd")
+def test_upload_trace(app, client, trace):
+    app.config["TLM_ASYNC_INGEST"] = False
+    data = {"file": (io.BytesIO(trace), "trace.tld")}
+    response = client.post("/upload", data=data)
+    assert b"Read 51 packets" in response.data
+    assert b"CU 2, unknown 10, LTU1.1 17" in response.data
+    assert not os.listdir(app.config["UPLOAD_FOLDER"])
+    with app.app_context():
+        assert db.session.query(Telemetry).count() == 51
+
+
+def test_table(app, client, trace_path):
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        rows, _ = get_store().query_series("brd", 1, route_time)
+
+    response = client.get(f"/table?set=brd&channel=LTU1.1&route={route_time}")
+
     assert response.status_code == 200
+    assert rows and response.data.count(b"<tr>") == len(rows) + 1
 
 
-def test_plot(client):
-    response = client.get("/plot/ltu1_1_brd.png")
+def test_plot(app, client, trace_path):
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+
+    response = client.get(f"/plot?set=brd&channel=LTU1.1&route={route_time}")
+    image_url = re.search(rb"/plot/\w+\.png", response.data).group().decode()
+    image = client.get(image_url)
+
     assert response.status_code == 200
+    assert image.status_code == 200
+    assert image.mimetype == "image/png" and image.data[:4] == b"\x89PNG"
+
+
+def test_upload_job(app, client, trace):
+    data = {"file": (io.BytesIO(trace), "trace.tld")}
+    response = client.post("/upload", data=data)
+    job_id = re.search(rb"/jobs/(\w+)", response.data).group(1).decode()
+
+    for _ in range(100):
+        status = client.get(f"/jobs/{job_id}").get_json()
+        if status["state"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+
+    assert status["state"] == "done"
+    assert status["packets"] == 51
+    assert status["progress"] == 1.0
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_epoch_ns_storage(app, client, trace):
+    app.config.update({"TLM_ASYNC_INGEST": False, "TLM_TIME_STORAGE": "epoch_ns"})
+    data = {"file": (io.BytesIO(trace), "trace.tld")}
+    assert b"Read 51 packets" in client.post("/upload", data=data).data
+
+    routes = re.findall(rb'value="(\d+)"', client.get("/").data)
+    assert len(set(routes)) == 2
+
+    query = f"channel=LTU1.1&set=brd&route={routes[-1].decode()}"
+    response = client.get(f"/table?{query}")
+    assert response.status_code == 200
+    assert b"<td>2014-01-01 00:00:" in response.data
+    assert client.get(f"/plot?{query}").status_code == 200
+
+
+def query_plan(stmt):
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[x] for x in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        return " / ".join(x[-1] for x in rows)
+
+
+@pytest.mark.parametrize("storage, suffix", [("datetime", ""), ("epoch_ns", "_ns")])
+def test_read_queries_use_indexes(app, storage, suffix):
+    app.config["TLM_TIME_STORAGE"] = storage
+    with app.app_context():
+        plan = query_plan(data_statement("brd", 1, 1_668_591_000))
+        assert f"USING INDEX ix_telemetry_channel_route{suffix} " in plan
+        assert "TEMP B-TREE" not in plan
+
+        plan = query_plan(routes_statement())
+        assert f"USING COVERING INDEX ix_telemetry_route{suffix}" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_sqlite_profiles(app):
+    with app.app_context():
+        assert db.session.execute(db.text("PRAGMA journal_mode")).scalar() == "wal"
+        assert db.session.execute(db.text("PRAGMA synchronous")).scalar() == 1
+
+        with db.engine.connect() as conn:
+            with bulk_profile(conn):
+                assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 0
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert conn.exec_driver_sql("PRAGMA temp_store").scalar() == 2
+
+
+def test_failed_ingest_keeps_data(app, trace_path, monkeypatch):
+    def fail(*args):
+        raise LookupError("broken packet")
+
+    with app.app_context():
+        assert get_telemetry(trace_path) == 51
+
+        monkeypatch.setitem(ROW_BUILDERS, "calibrated", fail)
+        with pytest.raises(LookupError, match="broken packet"):
+            get_telemetry(trace_path)
+
+        assert Telemetry.query.count() == 51
+
+
+@pytest.mark.parametrize("storage", ["datetime", "epoch_ns"])
+def test_columnar_store_matches_database(app, trace_path, storage):
+    app.config.update({"TLM_TIME_STORAGE": storage, "TLM_COLUMNAR": True})
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[-1][0]
+        times, values, names = collect_columns("ldd_rt", "LTU2.1", route_time)
+        series, _, _ = collect_series("ldd_rt", "LTU2.1", route_time)
+        assert isinstance(series[1], np.memmap)
+
+        app.config["TLM_COLUMNAR"] = False
+        get_cache().bump()
+        expected_times, expected, _ = collect_columns("ldd_rt", "LTU2.1", route_time)
+        expected_series, _, _ = collect_series("ldd_rt", "LTU2.1", route_time)
+
+        app.config.update({"TLM_COLUMNAR": True, "TLM_INGEST_MODE": "append"})
+        get_telemetry(trace_path)
+        assert columnar_series("ldd_rt", 2, route_time) is None
+
+    assert names == ["cutime", "ldd_rt1", "ldd_rt2", "ldd_rt3"]
+    assert len(times) == len(expected_times) == 8
+    assert [x.tolist() for x in values] == [x.tolist() for x in expected]
+    assert list(series[0]) == list(np.asarray(expected_series[0], "datetime64[ns]"))
+    if storage == "datetime":
+        assert times.tolist() == expected_times.tolist()
+
+
+@pytest.mark.parametrize("storage", ["datetime", "epoch_ns"])
+def test_stores_read_alike(app, trace_path, storage):
+    app.config.update({"TLM_TIME_STORAGE": storage, "TLM_STORE": "sqlite"})
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        stores = [get_store()]
+        app.config["TLM_STORE"] = "sqlalchemy"
+        stores.append(get_store())
+
+        routes = [x.list_routes() for x in stores]
+        assert len(routes[0]) == 2
+        series = [x.query_series("pls_cur", 3, routes[0][0][0]) for x in stores]
+
+    assert routes[0] == routes[1]
+    assert series[0] == series[1]
+    assert len(series[0][0]) == 9
+
+
+@pytest.mark.parametrize("storage", ["datetime", "epoch_ns"])
+def test_routes_are_partitioned(app, trace_path, tmp_path, storage):
+    folder = tmp_path / "partitions"
+    app.config.update(
+        {
+            "TLM_TIME_STORAGE": storage,
+            "TLM_PARTITION_FOLDER": str(folder),
+        }
+    )
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        routes = view_routes()
+        expected = [get_store().query_series("pls_cur", 3, x[0]) for x in routes]
+
+        app.config["TLM_STORE"] = "partitioned"
+        get_telemetry(trace_path)
+        store = get_store()
+        assert store.list_routes() == routes
+        assert [store.query_series("pls_cur", 3, x[0]) for x in routes] == expected
+        assert choose_level(3, routes[0][0], 1) is not None
+
+        app.config["TLM_INGEST_MODE"] = "append"
+        get_telemetry(trace_path)
+        assert store.query_series("pls_cur", 3, routes[0][0]) == expected[0]
+        store.drop_route(routes[0][0])
+        assert store.list_routes() == routes[1:]
+        assert choose_level(3, routes[0][0], 1) is None
+        assert store.query_series("pls_cur", 3, routes[1][0]) == expected[1]
+
+    assert sorted(os.listdir(folder)) == [f"{routes[1][0]}.sqlite", "unrouted.sqlite"]
+
+    # A swap stopped between the renames leaves the old folder to restore
+    os.replace(folder, f"{folder}.old")
+    with app.app_context():
+        assert get_store().list_routes() == routes[1:]
+    assert not os.path.exists(f"{folder}.old")
+
+
+def test_results_are_cached_per_generation(app, trace_path):
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        rows = collect_columns("pls_cur", "LTU3.1", route_time)
+        assert collect_columns("pls_cur", "LTU3.1", route_time) is rows
+        current = get_cache().refresh()
+
+        # Another worker process of the app shares the generation
+        other = ResultCache(1 << 20, DataGeneration())
+        assert other.fetch("a", lambda: rows) is rows
+
+        app.config["TLM_INGEST_MODE"] = "append"
+        get_telemetry(trace_path)
+        assert get_cache().refresh() > current
+        assert collect_columns("pls_cur", "LTU3.1", route_time) is not rows
+        assert other.fetch("a", lambda: None) is None
+
+    # The generation is read once per request or app context
+    with app.app_context():
+        current = get_cache().refresh()
+        with db.engine.begin() as conn:
+            conn.execute(generation.update().values(value=current + 1))
+        assert get_cache().refresh() == current
+
+    with app.app_context():
+        assert get_cache().refresh() == current + 1
+
+    cache = ResultCache(100)
+    values = [np.zeros(5) for _ in range(3)]
+    cache.fetch("a", lambda: values[0])
+    cache.fetch("b", lambda: values[1])
+    assert cache.fetch("a", lambda: None) is values[0]
+    cache.fetch("c", lambda: values[2])
+    assert list(cache.entries) == [(cache.generation, "a"), (cache.generation, "c")]
+    assert cache.size == 80
+
+
+def test_plots_are_cached(app, client, trace_path, monkeypatch):
+    folder = app.config["TLM_PLOT_FOLDER"]
+    app.config["TLM_PLOT_CACHE_BYTES"] = 1
+    rendered = []
+    plot_telemetry = render.plot_telemetry
+    monkeypatch.setattr(
+        render,
+        "plot_telemetry",
+        lambda *args: rendered.append(args[0]) or plot_telemetry(*args),
+    )
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        routes = [x[0] for x in view_routes()]
+
+    def plot_name(route_time):
+        response = client.get(f"/plot?set=brd&channel=LTU1.1&route={route_time}")
+        return re.search(rb"/plot/(\w+\.png)", response.data).group(1).decode()
+
+    filename = plot_name(routes[0])
+    assert plot_name(routes[0]) == filename
+    assert len(rendered) == 1
+
+    image = client.get(f"/plot/{filename}")
+    assert image.status_code == 200
+    assert image.headers["ETag"] == f'"{filename[:-4]}"'
+    assert "immutable" in image.headers["Cache-Control"]
+    headers = {"If-None-Match": image.headers["ETag"]}
+    assert client.get(f"/plot/{filename}", headers=headers).status_code == 304
+
+    assert plot_name(routes[1]) != filename
+    assert len(os.listdir(folder)) == 1
+    with app.app_context():
+        get_telemetry(trace_path)
+    assert plot_name(routes[0]) != filename
+    assert len(rendered) == 3
+
+
+def test_plots_render_alike_in_threads_and_workers(tmp_path):
+    times = np.arange("2022-11-15", "2022-11-16", dtype="datetime64[h]")
+    values = np.sin(np.arange(24.0))
+    args = ([times, values, 2 * values], ["cutime", "brd_lt1", "brd_lt2"], "LTU1.1")
+    Renderer(0, 0).render(str(tmp_path / "expected.png"), *args)
+
+    with ThreadPoolExecutor(4) as pool:
+        names = [str(tmp_path / f"{x}.png") for x in range(8)]
+        list(pool.map(lambda x: Renderer(0, 0).render(x, *args), names))
+
+    renderer = Renderer(1, 1)
+    renderer.render(str(tmp_path / "worker.png"), *args)
+    renderer.shutdown()
+
+    expected = (tmp_path / "expected.png").read_bytes()
+    assert all(open(x, "rb").read() == expected for x in names)
+    assert (tmp_path / "worker.png").read_bytes() == expected
+    assert not plt.get_fignums()
+
+
+@pytest.mark.parametrize("method", ["minmax", "lttb"])
+def test_decimation_keeps_spikes(client, method):
+    count = 100_000
+    times = np.datetime64("2022-11-15", "ns") + np.arange(count) * np.timedelta64(
+        125, "ms"
+    )
+    values = np.random.default_rng(0).normal(size=(2, count))
+    values[0, 54321] = 50
+    values[1, 12345] = -50
+
+    series, _ = decimate([times, *values], None, method, 2000)
+    short = [times[:10], values[0, :10]]
+
+    assert len(series[0]) <= 2 * 2000 + 2
+    assert series[1].max() == 50 and series[2].min() == -50
+    assert np.all(np.diff(series[0]) > np.timedelta64(0))
+    assert decimate(short, None, method, 2000)[0] is short
+    response = client.get(f"/plot?set=brd&channel=LTU1.1&route=0&decimate={method}x")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("storage", ["datetime", "epoch_ns"])
+def test_series_api(app, client, trace_path, storage):
+    app.config["TLM_TIME_STORAGE"] = storage
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        rows, _ = get_store().query_series("pls_cur", 3, route_time)
+
+    url = f"/api/series?set=pls_cur&channel=LTU3.1&route={route_time}"
+    series = client.get(url).get_json()
+    response = client.get(f"{url}&format=binary")
+    data = response.data
+    (size,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8: 8 + size])
+    columns = np.frombuffer(data, "<i8", header["rows"], 8 + size)
+    values = np.frombuffer(data, "<f4", header["rows"], 8 + size + 8 * header["rows"])
+    times = np.array(series["data"][0])
+    start, end = (times[1] + times[2]) / 2e9, (times[4] + times[5]) / 2e9
+    window = client.get(f"{url}&start={start}&end={end}").get_json()
+
+    assert series["columns"] == ["cutime_ns", "pls_i1", "pls_i2", "pls_i3", "pls_i4"]
+    assert series["data"][1] == [x[1] for x in rows]
+    assert np.all(np.diff(times) > 0) and len(times) == 9
+    if storage == "epoch_ns":
+        assert times.tolist() == [x[0] for x in rows]
+    else:
+        local = np.array([x[0] for x in rows], "M8[ns]")
+        assert list(epoch_ns_to_local(times)) == list(local)
+    assert data[:4] == b"TLMS" and (8 + size) % 8 == 0
+    assert header["dtypes"] == ["<i8"] + ["<f4"] * 4
+    assert columns.tolist() == times.tolist()
+    assert values.tolist() == pytest.approx(series["data"][1], rel=1e-6)
+    assert window["data"][0] == series["data"][0][2:5]
+    assert client.get(f"{url}&format=xml").status_code == 400
+    assert client.get(f"{url}&start=noon").status_code == 400
+    assert client.get(f"{url}&start=nan").status_code == 400
+    assert client.get(f"{url}&end=inf").status_code == 400
+    assert client.get(url.replace("LTU3.1", "LTU9.9")).status_code == 400
+
+
+@pytest.mark.parametrize("storage", ["datetime", "epoch_ns"])
+def test_rollups_summarise_routes(app, tmp_path, monkeypatch, storage):
+    path = tmp_path / "trace.tld"
+    path.write_bytes(make_trace(routes=(280_000_000,), per_route=3000))
+    app.config["TLM_TIME_STORAGE"] = storage
+
+    with app.app_context():
+        get_telemetry(str(path))
+        route_time = view_routes()[0][0]
+        rows, _ = get_store().query_series("brd", 2, route_time)
+
+        assert choose_level(2, route_time, PLOT_WIDTH) == 1
+        assert choose_level(2, route_time, 4000) is None
+        level = choose_level(2, route_time, 100)
+        assert level == 10
+        series, envelopes = collect_rollup(["brd_lt1"], 2, route_time, level)
+
+        app.config["TLM_INGEST_MODE"] = "append"
+        get_telemetry(str(path))
+        stmt = db.select([db.func.sum(rollup.c.count)]).where(
+            rollup.c.level == level, rollup.c.channel_id == 2
+        )
+        assert db.session.execute(stmt).scalar() == len(rows)
+
+        # Buckets split between chunks are merged
+        columns = [x for x in rollup.c if x.name not in ("id", "ft_t_on", "ft_t_on_ns")]
+        table = db.select(columns).order_by(*columns[:3])
+        whole = db.session.execute(table).all()
+        monkeypatch.setattr(rollups, "ROLLUP_CHUNK", 7)
+        app.config["TLM_INGEST_MODE"] = "replace"
+        get_telemetry(str(path))
+        chunked = db.session.execute(table).all()
+
+    assert np.array(chunked) == pytest.approx(np.array(whole), nan_ok=True)
+    values = np.array([x[1] for x in rows])
+    low, high = envelopes[0]
+    assert len(series[0]) == 300
+    assert np.all(np.diff(series[0]) == np.timedelta64(level, "s"))
+    assert low.min() == values.min() and high.max() == values.max()
+    assert np.all((low <= series[1]) & (series[1] <= high))
+
+
+@pytest.mark.parametrize("decoder, store", [("packet", "sqlalchemy"), ("numpy", "sqlite")])
+def test_counts_are_calibrated_on_read(app, trace_path, decoder, store):
+    app.config.update({"TLM_DECODER": decoder, "TLM_STORE": store, "TLM_COLUMNAR": True})
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        expected, _ = get_store().query_series("ldd_rt", 2, route_time)
+        expected_means = collect_rollup(["ldd_rt1"], 2, route_time, 1)[0][1]
+
+        app.config["TLM_VALUE_STORAGE"] = "counts"
+        get_telemetry(trace_path)
+        stored = db.session.execute(db.select(Telemetry.ldd_rt1)).scalars().all()
+        rows, _ = get_store().query_series("ldd_rt", 2, route_time)
+        series = columnar_series("ldd_rt", 2, route_time)
+        means = collect_rollup(["ldd_rt1"], 2, route_time, 1)[0][1]
+
+        db.session.execute(
+            db.update(Adjustment)
+            .where(Adjustment.channel_id == 2)
+            .values(ldd_rt1=Adjustment.ldd_rt1 + 1)
+        )
+        db.session.commit()
+        corrected, _ = get_store().query_series("ldd_rt", 2, route_time)
+
+    assert all(x.is_integer() for x in stored)
+    assert rows == expected
+    assert series[1].tolist() == [x[1] for x in expected]
+    assert means == pytest.approx(expected_means)
+    assert [x[1] - 1 for x in corrected] == pytest.approx([x[1] for x in rows])
+
+
+@pytest.mark.parametrize(
+    "store, storage",
+    [("sqlalchemy", "datetime"), ("sqlite", "epoch_ns"), ("partitioned", "datetime")],
+)
+def test_table_pages(app, client, trace_path, tmp_path, store, storage):
+    app.config.update(
+        {
+            "TLM_STORE": store,
+            "TLM_TIME_STORAGE": storage,
+            "TLM_PARTITION_FOLDER": str(tmp_path / "partitions"),
+            "TLM_TABLE_PAGE_ROWS": 4,
+        }
+    )
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        rows, _ = get_store().query_series("pls_cur", 3, route_time)
+
+        pages = [table_page("pls_cur", 3, route_time, None, False, 4)]
+        while pages[-1].next:
+            cursor = decode_cursor(pages[-1].next)
+            pages.append(table_page("pls_cur", 3, route_time, cursor, False, 4))
+        cursor = decode_cursor(pages[-1].previous)
+        back = table_page("pls_cur", 3, route_time, cursor, True, 4)
+
+    assert len(rows) == 9
+    assert [len(x.rows) for x in pages] == [4, 4, 1]
+    assert sum((x.rows for x in pages), []) == rows
+    assert pages[0].previous is None and pages[1].previous is not None
+    assert back == pages[1]
+
+    url = f"/table?set=pls_cur&channel=LTU3.1&route={route_time}"
+    first = client.get(url).data.decode()
+    second = client.get(f"{url}&after={pages[0].next}").data.decode()
+    streamed = client.get(f"{url}&stream=1").data.decode()
+
+    assert first.count("<tr>") == 5 and f"after={pages[0].next}" in first
+    assert f"before={pages[1].previous}" in second
+    assert streamed.count("<tr>") == 10 and "after=" not in streamed
+    assert client.get(f"{url}&after=bogus").status_code == 400
+
+
+@pytest.mark.parametrize(
+    "store, storage", [("sqlalchemy", "datetime"), ("partitioned", "epoch_ns")]
+)
+def test_csv_export(app, client, trace_path, tmp_path, store, storage):
+    app.config.update(
+        {
+            "TLM_STORE": store,
+            "TLM_TIME_STORAGE": storage,
+            "TLM_PARTITION_FOLDER": str(tmp_path / "partitions"),
+            "TLM_EXPORT_BATCH_ROWS": 4,
+        }
+    )
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        expected = {
+            x: get_store().query_series("brd", channel_id_by_name(x), route_time)[0]
+            for x in ("LTU1.1", "LTU2.1", "LTU3.1")
+        }
+
+    url = f"/export?route={route_time}"
+    response = client.get(f"{url}&set=brd&channel=LTU2.1")
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    route = list(csv.reader(io.StringIO(client.get(url).data.decode())))
+
+    assert response.mimetype == "text/csv" and "attachment" in str(response.headers)
+    assert rows[0] == ["channel", "cutime_ns" if storage == "epoch_ns" else "cutime"] + [
+        "brd_lt1", "brd_lt2", "brd_lt3", "brd_lt4"
+    ]
+    assert [x[0] for x in rows[1:]] == ["LTU2.1"] * len(expected["LTU2.1"])
+    assert [float(x[2]) for x in rows[1:]] == [x[1] for x in expected["LTU2.1"]]
+    assert len(route) == 1 + sum(len(x) for x in expected.values())
+    assert len(route[0]) == len(route[1]) > 30
+    assert client.get(f"{url}&set=brd").status_code == 400
+    assert client.get(f"{url}&format=xlsx").status_code == 400
+    assert client.get("/export?route=1").status_code == 404
+
+
+def test_parquet_export(app, client, trace_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    app.config["TLM_EXPORT_BATCH_ROWS"] = 4
+
+    with app.app_context():
+        get_telemetry(trace_path)
+        route_time = view_routes()[0][0]
+        rows, columns = get_store().query_series("pls_cur", 3, route_time)
+
+    url = f"/export?route={route_time}&set=pls_cur&channel=LTU3.1&format=parquet"
+    data = client.get(url).data
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    table = parquet.read()
+
+    assert table.column_names == ["channel", *columns]
+    assert parquet.num_row_groups == -(-len(rows) // 4)
+    assert table.column("pls_i1").to_pylist() == [x[1] for x in rows]
+    assert table.column("cutime").to_pylist() == [x[0] for x in rows]
+
+
+def test_migration_removes_duplicates(app, caplog):
+    with app.app_context():
+        db.session.execute(db.text("DROP INDEX ix_telemetry_channel_cutime"))
+        db.session.execute(
+            db.text(
+                "INSERT INTO telemetry (channel_id, cutime) VALUES "
+                "(1, '2014-01-01 00:00:00.000000'), (1, '2014-01-01 00:00:00.000000')"
+            )
+        )
+        db.session.commit()
+        init_db()
+
+        assert db.session.query(Telemetry).count() == 1
+        assert "Removed 1 duplicate packets" in caplog.text
@@ -0,0 +1,197 @@
+import random
+from collections import Counter
+from datetime import timedelta, timezone
+import numpy as np
+import pytest
+from tests.conftest import CU_IP, LTU_IPS, make_packet
+from tlm_app import bulk, packet
+from tlm_app.framing import FrameStats
+from tlm_app.ip import PACKET_SIZE
+from tlm_app.layout import ROW_BUILDERS, ROW_COLUMNS, Field, Layout
+from tlm_app.models import Telemetry
+from tlm_app.timestamp import (
+    SCS_EPOCH,
+    SCS_EPOCH_NS,
+    timestamps_to_datetime64,
+    timestamp_to_unixtime,
+)
+from tlm_app.packet import (
+    get_telemetry,
+    init_tables,
+    read_dataclasses,
+    read_packets,
+    read_trace,
+    read_telemetry,
+)
+
+
+def damage(trace):
+    frames = [trace[x: x + PACKET_SIZE] for x in range(0, len(trace), PACKET_SIZE)]
+    clean = b"".join(frames[:20] + frames[21:])
+    broken = frames[20][:12] + b"\0\0" + frames[20][14:]
+    damaged = b"".join(frames[:5] + [b"\xff"] + frames[5:20] + [broken] + frames[21:])
+    return clean, damaged + bytes(100)
+
+
+@pytest.mark.parametrize("read", [read_packets, read_trace])
+def test_decoders_match_dataclasses(app, trace, read):
+    expected_counts, counts = Counter(), Counter()
+    with app.app_context():
+        init_tables()
+        expected = list(read_dataclasses(trace, expected_counts, FrameStats()))
+        assert list(read(trace, counts, FrameStats())) == expected
+
+    assert len(expected) == 51
+    assert expected[0][2] is None
+    assert counts == expected_counts == {-1: 2, 0: 10, 1: 17, 2: 16, 3: 18}
+
+
+class DecodeError(Exception):
+    pass
+
+
+def fail(*args):
+    raise DecodeError
+
+
+@pytest.mark.parametrize("decoder", ["numpy", "packet", "dataclass"])
+def test_decoding_errors_reach_the_caller(app, trace_path, monkeypatch, decoder):
+    monkeypatch.setattr(bulk, "cutime_column", fail)
+    monkeypatch.setitem(ROW_BUILDERS, "calibrated", fail)
+    monkeypatch.setattr(packet, "get_cutime", fail)
+    app.config.update({"TLM_DECODER": decoder, "TLM_STORE": "sqlite"})
+
+    with app.app_context(), pytest.raises(DecodeError):
+        get_telemetry(trace_path)
+
+
+@pytest.mark.parametrize("decoder", ["numpy", "packet", "dataclass"])
+def test_channels_without_adjustments(app, tmp_path, decoder):
+    path = tmp_path / "second.tld"
+    path.write_bytes(
+        make_packet(CU_IP, 1, sub_type=1, t_on=280_000_000)
+        + make_packet(LTU_IPS[0], 2, rng=random.Random(0))
+        + make_packet("172.16.1.12", 2, rng=random.Random(0))
+    )
+    app.config["TLM_DECODER"] = decoder
+
+    with app.app_context():
+        assert get_telemetry(str(path)) == 2
+        adjusted, plain = Telemetry.query.order_by(Telemetry.id)
+
+    assert plain.channel_id == 4
+    assert plain.ldd_lt1 == adjusted.ldd_lt1
+    assert plain.ldd_rt1 == pytest.approx(adjusted.ldd_rt1 - 1.6)
+    assert plain.ldd_rt3 == pytest.approx(adjusted.ldd_rt3 - 1.5)
+
+
+@pytest.mark.parametrize("store", ["sqlalchemy", "sqlite"])
+@pytest.mark.parametrize("batch", [7, 10000])
+def test_rows_are_stored_by_column(app, trace, trace_path, batch, store):
+    app.config.update({"TLM_INSERT_BATCH": batch, "TLM_STORE": store})
+
+    with app.app_context():
+        expected = list(read_dataclasses(trace, Counter(), FrameStats()))
+        assert get_telemetry(trace_path) == len(expected)
+        stored = [
+            tuple(getattr(tlm, x) for x in ROW_COLUMNS)
+            for tlm in Telemetry.query.order_by(Telemetry.id)
+        ]
+
+    assert stored == [
+        (x[0], x[1].replace(tzinfo=None), x[2] and x[2].replace(tzinfo=None)) + x[3:]
+        for x in expected
+    ]
+
+
+def test_layout_compiles_one_struct():
+    fields = (Field("a", 4, "H", 0.5, -1), Field("b", 0, "I"), Field("c", 6, "H", 2, 0, 1))
+    layout = Layout(fields, fields)
+    assert layout.struct.format == "<IHH1084x"
+    assert layout.build_row((7, 4, 3), (10, 20)) == (1.0, 7, 26)
+
+    with pytest.raises(ValueError):
+        Layout((Field("a", 0, "I"), Field("b", 2, "H")), ())
+
+
+def test_parallel_ingest_keeps_routes(app, trace, trace_path):
+    counts = Counter()
+    with app.app_context():
+        expected = list(read_dataclasses(trace, Counter(), FrameStats()))
+        app.config.update({"TLM_INGEST_WORKERS": 2, "TLM_INGEST_CHUNK": 7})
+        assert list(read_telemetry(trace_path, counts, FrameStats())) == expected
+
+    assert counts[-1] == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("decoder", ["dataclass", "packet", "numpy"])
+def test_damaged_frames_are_skipped(app, trace, tmp_path, decoder, workers):
+    clean, damaged = damage(trace)
+    path = tmp_path / "trace.tld"
+    path.write_bytes(damaged)
+
+    stats = FrameStats()
+    with app.app_context():
+        init_tables()
+        expected = list(read_dataclasses(clean, Counter(), FrameStats()))
+        app.config.update(
+            {"TLM_DECODER": decoder, "TLM_INGEST_WORKERS": workers, "TLM_INGEST_CHUNK": 7}
+        )
+        assert list(read_telemetry(str(path), Counter(), stats)) == expected
+
+    assert stats.frames == len(clean) // PACKET_SIZE
+    assert stats.skipped_bytes == 1 + PACKET_SIZE + 100
+    assert stats.skipped_frames == 3
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("decoder", ["packet", "numpy"])
+def test_epoch_ns_times(app, trace, trace_path, decoder, workers):
+    with app.app_context():
+        init_tables()
+        expected = list(read_dataclasses(trace, Counter(), FrameStats(), "datetime"))
+        app.config.update(
+            {
+                "TLM_DECODER": decoder,
+                "TLM_INGEST_WORKERS": workers,
+                "TLM_INGEST_CHUNK": 7,
+                "TLM_TIME_STORAGE": "epoch_ns",
+            }
+        )
+        records = list(read_telemetry(trace_path, Counter(), FrameStats()))
+
+    assert [(x[1] - SCS_EPOCH_NS + 500) // 1000 for x in records] == [
+        (x[1] - SCS_EPOCH) // timedelta(microseconds=1) for x in expected
+    ]
+    assert [x[2] for x in records] == [
+        x[2] and int(x[2].timestamp()) * 10**9 for x in expected
+    ]
+    assert [x[3:] for x in records] == [x[3:] for x in expected]
+
+
+def test_timestamps_to_datetime64():
+    ticks = np.array([0, 1, 125_000_000, 10**12], dtype=np.uint64)
+    times = timestamps_to_datetime64(ticks)
+    assert times.dtype == np.dtype("datetime64[ns]")
+    assert (times[1] - times[0]).astype(int) == 8
+
+    expected = [
+        timestamp_to_unixtime(x).astimezone(timezone.utc).replace(tzinfo=None)
+        for x in ticks.tolist()
+    ]
+    assert times.astype("datetime64[us]").tolist() == expected
+
+
+@pytest.mark.parametrize("store", ["sqlalchemy", "sqlite"])
+def test_append_skips_stored_packets(app, trace, tmp_path, store):
+    first, whole = tmp_path / "first.tld", tmp_path / "whole.tld"
+    first.write_bytes(trace[: 30 * PACKET_SIZE])
+    whole.write_bytes(trace)
+    app.config.update({"TLM_INGEST_MODE": "append", "TLM_STORE": store})
+
+    with app.app_context():
+        assert get_telemetry(str(first)) == 25
+        assert get_telemetry(str(whole)) == 51
+        assert get_telemetry(str(whole)) == 51
+        assert Telemetry.query.count() == 51
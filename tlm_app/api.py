@@ -0,0 +1,79 @@
+"""
+Column-oriented series for client-side charts
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import struct
+import numpy as np
+from .timestamp import SECOND_NS
+
+SERIES_FORMATS = ("json", "binary")
+TIME_COLUMN = "cutime_ns"
+# Binary series start with the magic and the header length
+MAGIC = b"TLMS"
+ALIGNMENT = 8
+
+
+def window_bound(value: str | None) -> float | None:
+    """
+    Parse the time window bound given as Unix time in seconds.
+    """
+
+    if value is None:
+        return None
+
+    bound = float(value)
+    if not math.isfinite(bound):
+        msg = f"Invalid time window bound '{value}'"
+        raise ValueError(msg)
+
+    return bound
+
+
+def time_window(times: np.ndarray, start: float | None, end: float | None) -> slice:
+    """
+    Rows with CU times from the start up to the end, given as Unix times
+    in seconds. CU times are Unix times in nanoseconds in the ascending order.
+    """
+
+    first, last = 0, len(times)
+    if start is not None:
+        first = int(np.searchsorted(times, int(start * SECOND_NS)))
+    if end is not None:
+        last = int(np.searchsorted(times, int(end * SECOND_NS)))
+
+    return slice(first, last)
+
+
+def series_json(header: dict, times: np.ndarray, values: list[np.ndarray]) -> dict:
+    """
+    Header and the columns as arrays. CU times are integer nanoseconds.
+    """
+
+    return {**header, "data": [times.tolist()] + [x.tolist() for x in values]}
+
+
+def series_binary(header: dict, times: np.ndarray, values: list[np.ndarray]) -> bytes:
+    """
+    The magic, the header length as a little-endian 32-bit integer and
+    the JSON header with the row count and column types, padded so that
+    the columns start 8-byte aligned. Then the columns follow one after
+    another: CU times as little-endian Int64, values as Float32.
+    """
+
+    columns = [times.astype("<i8")] + [x.astype("<f4") for x in values]
+    header = {
+        **header,
+        "rows": len(times),
+        "dtypes": [x.dtype.str for x in columns],
+    }
+
+    text = json.dumps(header).encode()
+    text += b" " * (-(len(MAGIC) + 4 + len(text)) % ALIGNMENT)
+
+    return b"".join(
+        [MAGIC, struct.pack("<I", len(text)), text] + [x.tobytes() for x in columns]
+    )
@@ -25,7 +25,7 @@ class BrdTelemetry:
     lt4: float
 
     @staticmethod
-    def load_from_packet(packet: bytes) -> BrdTelemetry:
+    def load_from_packet(packet: bytes | memoryview) -> BrdTelemetry:
         """
         Get BRD temperatures.
         """
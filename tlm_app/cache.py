@@ -0,0 +1,191 @@
+"""
+In-process cache of table and plot data
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Hashable
+import numpy as np
+from flask import current_app, g
+from .database import db
+from .models import generation
+
+# pylint: disable=no-member
+
+
+def approx_size(value: Any) -> int:
+    """
+    Approximate size of the result in bytes. Rows of a list are taken
+    to be the size of its first row.
+    """
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(approx_size(x) for x in value)
+
+    if isinstance(value, list):
+        if not value:
+            return sys.getsizeof(value)
+        return sys.getsizeof(value) + len(value) * approx_size(value[0])
+
+    return 0 if value is None else sys.getsizeof(value)
+
+
+class DataGeneration:
+    """
+    Data generation kept in the database, so that every process
+    of the app sees the telemetry change. It is read once per request,
+    or app context, and kept in 'g' for the lookups that follow.
+    """
+
+    def read(self) -> int:
+        """
+        Get the current generation.
+        """
+
+        if "tlm_generation" not in g:
+            with db.engine.connect() as conn:
+                stmt = db.select([generation.c.value])
+                g.tlm_generation = conn.execute(stmt).scalar_one()
+
+        return g.tlm_generation
+
+    def bump(self) -> None:
+        """
+        Start a new generation.
+        """
+
+        with db.engine.begin() as conn:
+            conn.execute(generation.update().values(value=generation.c.value + 1))
+        g.pop("tlm_generation", None)
+
+
+class LocalGeneration:
+    """
+    Data generation of a cache used by a single process
+    """
+
+    def __init__(self):
+        self.value = time.time_ns()
+
+    def read(self) -> int:
+        """
+        Get the current generation.
+        """
+
+        return self.value
+
+    def bump(self) -> None:
+        """
+        Start a new generation.
+        """
+
+        self.value += 1
+
+
+class ResultCache:
+    """
+    Results of data queries kept in the least recently used order up to
+    the size limit. Keys include the data generation, which is increased
+    whenever the stored telemetry changes and is checked on every lookup,
+    so a stale result is not served. Cached results are shared and
+    must not be modified.
+    """
+
+    def __init__(
+        self, max_bytes: int, source: DataGeneration | LocalGeneration | None = None
+    ):
+        self.max_bytes = max_bytes
+        self.source = source if source is not None else LocalGeneration()
+        self.generation: int | None = None
+        self.entries: OrderedDict[tuple, tuple[Any, int]] = OrderedDict()
+        self.size = 0
+        self.lock = Lock()
+
+    def refresh(self) -> int:
+        """
+        Get the current data generation, dropping the results
+        of the earlier ones.
+        """
+
+        current = self.source.read()
+        with self.lock:
+            if current != self.generation:
+                self.generation = current
+                self.entries.clear()
+                self.size = 0
+
+        return current
+
+    def bump(self) -> None:
+        """
+        Start a new data generation, dropping every result.
+        """
+
+        self.source.bump()
+        self.refresh()
+
+    def fetch(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Get the result of the key, computing it if it is not cached.
+        Results of a generation which ended while they were computed
+        are not kept.
+        """
+
+        current = self.refresh()
+        with self.lock:
+            entry = self.entries.get((current, key))
+            if entry is not None:
+                self.entries.move_to_end((current, key))
+                return entry[0]
+
+        result = compute()
+        size = approx_size(result)
+        if size > self.max_bytes or self.refresh() != current:
+            return result
+
+        with self.lock:
+            if current != self.generation:
+                return result
+
+            old = self.entries.pop((current, key), None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[current, key] = result, size
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+        return result
+
+
+def get_cache() -> ResultCache:
+    """
+    Cache of the current app.
+    """
+
+    return current_app.extensions["tlm_cache"]
+
+
+def cached(kind: str) -> Callable:
+    """
+    Cache the results of the data function by its arguments.
+    """
+
+    def decorate(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args):
+            return get_cache().fetch((kind, *args), lambda: func(*args))
+
+        return wrapper
+
+    return decorate
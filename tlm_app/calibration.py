@@ -0,0 +1,97 @@
+"""
+Calibration of telemetry values stored as raw ADC counts
+"""
+
+from __future__ import annotations
+
+from typing import Sequence
+import numpy as np
+from flask import current_app
+from .database import db
+from .layout import TELEMETRY_FIELDS, Field
+from .ldd import NO_ADJUSTMENTS
+from .models import Adjustment
+
+# pylint: disable=no-member
+
+FIELDS = {x.name: x for x in TELEMETRY_FIELDS}
+
+
+def counts_storage() -> bool:
+    """
+    Check if telemetry values are stored as raw ADC counts.
+    """
+
+    return current_app.config["TLM_VALUE_STORAGE"] == "counts"
+
+
+def channel_adjustments(channel_id: int) -> tuple[float, ...]:
+    """
+    RT adjustments of the channel as they are in the database now,
+    so that corrected adjustments apply to the stored counts at once.
+    """
+
+    stmt = db.select(
+        [Adjustment.ldd_rt1, Adjustment.ldd_rt2, Adjustment.ldd_rt3]
+    ).where(Adjustment.channel_id == channel_id)
+    row = db.session.execute(stmt).first()
+
+    return NO_ADJUSTMENTS if row is None else tuple(row)
+
+
+def calibrate(field: Field, value, adjustments: Sequence[float]):
+    """
+    Scale the raw value, given as a number, an array or an SQL expression,
+    with the same operations in the same order as the decoders.
+    """
+
+    if field.scale != 1:
+        value = field.scale * value
+    if field.bias:
+        value = value + field.bias
+    if field.adjustment is not None:
+        value = value + adjustments[field.adjustment]
+
+    return value
+
+
+def value_sql(name: str, adjustments: Sequence[float]) -> tuple[str, list[float]]:
+    """
+    SQL text of the calibrated column with its parameters, for the sqlite3
+    module. Columns other than telemetry values are kept as they are.
+    """
+
+    if name not in FIELDS:
+        return name, []
+
+    field = FIELDS[name]
+    sql = name
+    params: list[float] = []
+    if field.scale != 1:
+        sql = f"? * {sql}"
+        params.append(field.scale)
+    if field.bias:
+        sql = f"{sql} + ?"
+        params.append(field.bias)
+    if field.adjustment is not None:
+        sql = f"{sql} + ?"
+        params.append(adjustments[field.adjustment])
+
+    return f"{sql} AS {name}", params
+
+
+def calibrate_series(
+    names: Sequence[str], series: list[np.ndarray], channel_id: int
+) -> list[np.ndarray]:
+    """
+    Calibrate the telemetry values among the named arrays of counts.
+    """
+
+    adjustments = channel_adjustments(channel_id)
+
+    return [
+        calibrate(FIELDS[name], values.astype(np.float64), adjustments)
+        if name in FIELDS
+        else values
+        for name, values in zip(names, series)
+    ]
@@ -2,47 +2,72 @@
 LTU channels processing
 """
 
-from ipaddress import IPv4Address
+from __future__ import annotations
+
+from collections import Counter
 from struct import unpack_from
 from .models import Channel
 from .database import db
 from .ip import IP_OFF, DATA_OFF
 from .cu_unit import CU_IP
 
-CHANNELS = {}
+# Sub-type word of the CU packets
+SUB_TYPE_FMT = "<H"
+SUB_TYPE_OFF = DATA_OFF + 8
+
+# Packet classes besides LTU channels, which are classified by their ids
+CU = -1
+UNKNOWN = 0
+CU_SUB_TYPE = 1
 
 
-def init_dct():
+class Classifier:
     """
-    Initialize channels dictionary with the db table
+    Packet classifier keyed on the raw source IP bytes and the sub-type word,
+    compiled from the channels table.
+    It also counts packets of every class and looks channels up by name.
     """
 
-    # pylint: disable=no-member
+    def __init__(self):
+        self.classes: dict[bytes, int] = {}
+        self.names: dict[int, str] = {}
+        self.ids: dict[str, int] = {}
 
-    res = db.session.execute(db.select(Channel.ip, Channel.id))
-    for ch_ip, ch_id in res:
-        CHANNELS[ch_ip] = ch_id
+    def load(self) -> None:
+        """
+        Compile the classes from the db table
+        """
 
+        # pylint: disable=no-member
 
-def get_ltu_channel(packet: bytes) -> int:
-    """
-    Return the LTU channel id from LTU IP address.
-    """
+        self.classes = {CU_IP.packed: CU}
+        self.names = {CU: "CU", UNKNOWN: "unknown"}
+        self.ids = {}
 
-    if not CHANNELS:
-        init_dct()
+        res = db.session.execute(db.select(Channel.ip, Channel.id, Channel.name))
+        for ch_ip, ch_id, name in res:
+            self.classes[ch_ip.to_bytes(4, "big")] = ch_id
+            self.names[ch_id] = name
+            self.ids[name] = ch_id
 
-    ch_ip = int(IPv4Address(packet[IP_OFF: IP_OFF + 4]))
+    def classify(self, packet: bytes | memoryview) -> int:
+        """
+        Return the LTU channel id, CU or UNKNOWN of the packet.
+        """
 
-    return CHANNELS[ch_ip]
+        kind = self.classes.get(bytes(packet[IP_OFF: IP_OFF + 4]), UNKNOWN)
+        (sub_type,) = unpack_from(SUB_TYPE_FMT, packet, SUB_TYPE_OFF)
+        if kind == CU and sub_type != CU_SUB_TYPE:
+            return UNKNOWN
 
+        return kind
 
-def is_cu_packet(packet: bytes) -> bool:
-    """
-    Check if the packet is a CU packet
-    """
+    def report(self, counts: Counter) -> dict[str, int]:
+        """
+        Name the packet counts by class.
+        """
+
+        return {self.names[kind]: counts[kind] for kind in sorted(counts)}
 
-    ch_ip = IPv4Address(packet[IP_OFF: IP_OFF + 4])
-    sub_type = unpack_from("<H", packet, DATA_OFF + 8)
 
-    return ch_ip == CU_IP and sub_type[0] == 1
+CLASSIFIER = Classifier()
@@ -28,7 +28,7 @@ class ChgTelemetry:
     vtdiv1: float
 
     @staticmethod
-    def load_from_packet(packet: bytes) -> ChgTelemetry:
+    def load_from_packet(packet: bytes | memoryview) -> ChgTelemetry:
         """
         Get CHG currents and voltages.
         """
@@ -0,0 +1,148 @@
+"""
+Columnar store of telemetry series, one file per route, channel and column
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from .layout import TELEMETRY_COLUMNS
+from .timestamp import SECOND_NS
+
+# Marks a store written by a whole ingest
+COMPLETE = "complete"
+TIME_COLUMN = "cutime"
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def column_dtype(name: str) -> np.dtype:
+    """
+    CU times are kept as Unix times in nanoseconds, values as doubles.
+    """
+
+    return np.dtype(np.int64 if name == TIME_COLUMN else np.float64)
+
+
+def route_seconds(ft_t_on: datetime | int) -> int:
+    """
+    Route time in seconds, as the route is requested. Datetime routes
+    are stored as local times and requested in the server time zone.
+    """
+
+    if isinstance(ft_t_on, int):
+        return ft_t_on // SECOND_NS
+
+    return int(ft_t_on.replace(tzinfo=None).timestamp())
+
+
+def epoch_ns(cutime: datetime | int) -> int:
+    """
+    CU time as Unix time in nanoseconds.
+    """
+
+    if isinstance(cutime, int):
+        return cutime
+
+    return (cutime - UNIX_EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def clear_store(folder: str) -> None:
+    """
+    Remove the store, so that readers use the database.
+    """
+
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+class ColumnWriter:
+    """
+    Rows grouped by route and channel and appended column by column
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.groups: defaultdict[tuple, list[tuple]] = defaultdict(list)
+        self.paths: set[str] = set()
+
+    def add(self, row: tuple) -> None:
+        """
+        Keep the decoded row until the next flush.
+        Packets before the first CU packet have no route and are not stored.
+        """
+
+        if row[2] is not None:
+            self.groups[row[2], row[0]].append(row)
+
+    def flush(self) -> None:
+        """
+        Append the kept rows to the column files.
+        """
+
+        for (ft_t_on, channel_id), rows in self.groups.items():
+            path = os.path.join(
+                self.folder, str(route_seconds(ft_t_on)), str(channel_id)
+            )
+            os.makedirs(path, exist_ok=True)
+            self.paths.add(path)
+
+            columns: dict[str, np.ndarray] = {
+                TIME_COLUMN: np.array([epoch_ns(x[1]) for x in rows], dtype=np.int64)
+            }
+            values = np.array([x[3:] for x in rows], dtype=np.float64)
+            for num, name in enumerate(TELEMETRY_COLUMNS):
+                columns[name] = values[:, num]
+
+            for name, column in columns.items():
+                with open(os.path.join(path, name), "ab") as file:
+                    column.tofile(file)
+
+        self.groups.clear()
+
+    def finish(self) -> None:
+        """
+        Flush the rows, put every series in the CU time order
+        and mark the store complete.
+        """
+
+        self.flush()
+
+        for path in self.paths:
+            cutimes = np.fromfile(os.path.join(path, TIME_COLUMN), np.int64)
+            if np.all(cutimes[1:] >= cutimes[:-1]):
+                continue
+
+            order = np.argsort(cutimes, kind="stable")
+            for name in (TIME_COLUMN,) + TELEMETRY_COLUMNS:
+                column_path = os.path.join(path, name)
+                column = np.fromfile(column_path, column_dtype(name))
+                column[order].tofile(column_path)
+
+        with open(os.path.join(self.folder, COMPLETE), "w", encoding="utf-8"):
+            pass
+
+
+def read_series(
+    folder: str, route_time: int, channel_id: int, names: list[str]
+) -> list[np.ndarray] | None:
+    """
+    Map the named columns of the channel route into memory, read-only.
+    Return None if the store does not have the route and channel.
+    """
+
+    path = os.path.join(folder, str(route_time), str(channel_id))
+    if not os.path.exists(os.path.join(folder, COMPLETE)) or not os.path.isdir(path):
+        return None
+
+    series: list[np.ndarray] = []
+    for name in names:
+        column_path = os.path.join(path, name)
+        dtype = column_dtype(name)
+        if os.path.getsize(column_path):
+            series.append(np.memmap(column_path, dtype, mode="r"))
+        else:
+            series.append(np.empty(0, dtype))
+
+    return series
@@ -3,20 +3,20 @@ CUTIME telemetry handling
 """
 
 from datetime import datetime
+from struct import unpack_from
 from .ip import DATA_OFF
 from .timestamp import timestamp_to_unixtime
 
 CUTIME_OFF = DATA_OFF + 44
 CUTIME_W = 8
+CUTIME_FMT = "<Q"
 
 
-def get_cutime(packet: bytes) -> datetime:
+def get_cutime(packet: bytes | memoryview) -> datetime:
     """
     Get CU time in the Unix time format.
     """
 
-    tstamp = int.from_bytes(
-        packet[CUTIME_OFF: CUTIME_OFF + CUTIME_W], byteorder="little"
-    )
+    (tstamp,) = unpack_from(CUTIME_FMT, packet, CUTIME_OFF)
 
     return timestamp_to_unixtime(tstamp)
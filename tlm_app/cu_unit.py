@@ -27,7 +27,7 @@ class CUTelemetry:
     ft_t_on: datetime
 
     @staticmethod
-    def load_from_packet(packet: bytes) -> CUTelemetry:
+    def load_from_packet(packet: bytes | memoryview) -> CUTelemetry:
         """
         Get CU unit mission scenario.
         """
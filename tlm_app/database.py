@@ -2,7 +2,13 @@
 Declarative mapping construction
 """
 
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy  # type: ignore
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection
 from .ip_const import LTU_IP_DICT
 from .adj_const import RT_ADD_DICT
 
@@ -10,6 +16,70 @@ from .adj_const import RT_ADD_DICT
 db = SQLAlchemy()
 
 
+def apply_pragmas(dbapi_connection, pragmas: dict) -> None:
+    """
+    Set SQLite pragmas on the DB-API connection.
+    """
+
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def init_engine(app: Flask) -> None:
+    """
+    Apply the configured SQLite profile to every new connection.
+    """
+
+    engine = db.get_engine(app)
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = app.config["TLM_SQLITE_PRAGMAS"]
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+@contextmanager
+def bulk_pragmas(dbapi_connection) -> Iterator[None]:
+    """
+    Apply the bulk ingest SQLite profile to the DB-API connection
+    and restore the previous settings afterwards.
+    """
+
+    pragmas = current_app.config["TLM_SQLITE_BULK_PRAGMAS"]
+    if not pragmas:
+        yield
+        return
+
+    cursor = dbapi_connection.cursor()
+    saved = {x: cursor.execute(f"PRAGMA {x}").fetchone()[0] for x in pragmas}
+    cursor.close()
+
+    apply_pragmas(dbapi_connection, pragmas)
+    try:
+        yield
+    finally:
+        apply_pragmas(dbapi_connection, saved)
+
+
+@contextmanager
+def bulk_profile(connection: Connection) -> Iterator[Connection]:
+    """
+    Apply the bulk ingest SQLite profile to the SQLAlchemy connection.
+    """
+
+    if connection.dialect.name != "sqlite":
+        yield connection
+        return
+
+    with bulk_pragmas(connection.connection):
+        yield connection
+
+
 # noinspection PyArgumentList
 def init_db():
     """
@@ -18,9 +88,10 @@ def init_db():
 
     # pylint: disable=no-member,import-outside-toplevel,cyclic-import
 
-    from tlm_app.models import Channel, Adjustment
+    from tlm_app.models import Channel, Adjustment, generation
 
     db.create_all()
+    migrate()
 
     stmt = db.select([db.func.count()]).select_from(Channel)
     if not db.session.execute(stmt).scalar():
@@ -41,4 +112,60 @@ def init_db():
             )
             db.session.add(adj)
 
+    # Generations of different databases differ, so that results kept
+    # outside of the database, such as plot images, are not taken for new
+    stmt = db.select([db.func.count()]).select_from(generation)
+    if not db.session.execute(stmt).scalar():
+        db.session.execute(generation.insert().values(value=time.time_ns()))
+
+    db.session.commit()
+
+
+def migrate():
+    """
+    Add columns and indexes missing from the tables of an older database.
+    Duplicate packets are removed before a unique index is created.
+    """
+
+    # pylint: disable=no-member,import-outside-toplevel,cyclic-import
+    # pylint: disable=logging-fstring-interpolation
+
+    from tlm_app.models import Telemetry
+
+    table = Telemetry.__table__
+    inspector = inspect(db.engine)
+    existing = {x["name"] for x in inspector.get_columns(table.name)}
+
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(db.engine.dialect)
+            db.session.execute(
+                db.text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+            )
+
+    indexes = {x["name"] for x in inspector.get_indexes(table.name)}
+
+    for index in table.indexes:
+        if index.name in indexes:
+            continue
+        if index.unique:
+            names = [x.name for x in index.columns]
+            known = " AND ".join(f"{x} IS NOT NULL" for x in names)
+            deleted = db.session.execute(
+                db.text(
+                    f"DELETE FROM {table.name} WHERE {known} AND id NOT IN "
+                    f"(SELECT min(id) FROM {table.name} WHERE {known} "
+                    f"GROUP BY {', '.join(names)})"
+                )
+            ).rowcount
+            if deleted:
+                current_app.logger.warning(
+                    f"Removed {deleted} duplicate packets "
+                    f"before creating the index {index.name}"
+                )
+        db.session.commit()
+        index.create(db.engine)
+
     db.session.commit()
@@ -0,0 +1,99 @@
+"""
+Decimation of long series before plotting
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import matplotlib.dates as md  # type: ignore
+
+DECIMATORS = ("none", "minmax", "lttb")
+
+
+def minmax_indices(values: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    Indices of the first and last rows and of the minimum and maximum
+    of every column in each of the buckets of equal row counts,
+    so that no spike is lost.
+    """
+
+    count = len(values)
+    size = -(-count // buckets)
+    buckets = -(-count // size)
+    padding = ((0, buckets * size - count), (0, 0))
+
+    lows = np.pad(values, padding, constant_values=np.inf)
+    highs = np.pad(values, padding, constant_values=-np.inf)
+    starts = (np.arange(buckets) * size)[:, None]
+    lowest = starts + lows.reshape(buckets, size, -1).argmin(axis=1)
+    highest = starts + highs.reshape(buckets, size, -1).argmax(axis=1)
+
+    return np.unique(np.concatenate(([0, count - 1], lowest.ravel(), highest.ravel())))
+
+
+def lttb_indices(x: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices selected by Largest-Triangle-Three-Buckets for every column:
+    the point of each bucket making the largest triangle with the point
+    selected in the previous bucket and the mean of the next one.
+    Buckets are processed in turn, all columns at once.
+    """
+
+    count = len(values)
+    every = (count - 2) / (threshold - 2)
+    columns = np.arange(values.shape[1])
+    selected = np.empty((threshold, values.shape[1]), dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+
+    previous = selected[0]
+    for num in range(threshold - 2):
+        start = int(num * every) + 1
+        end = int((num + 1) * every) + 1
+        next_end = min(int((num + 2) * every) + 1, count)
+
+        mean_x = x[end:next_end].mean()
+        mean_y = values[end:next_end].mean(axis=0)
+        prev_x = x[previous]
+        prev_y = values[previous, columns]
+
+        area = np.abs(
+            (prev_x - mean_x) * (values[start:end] - prev_y)
+            - (prev_x - x[start:end, None]) * (mean_y - prev_y)
+        )
+        previous = start + area.argmax(axis=0)
+        selected[num + 1] = previous
+
+    return np.unique(selected)
+
+
+def decimate(
+    series: list, envelopes: list[tuple] | None, method: str, points: int
+) -> tuple[list, list[tuple] | None]:
+    """
+    Reduce the times and values to about the given number of points per
+    value with the method, keeping the points selected for any value,
+    so that the values still share the times. Short series are kept.
+    """
+
+    if method not in DECIMATORS:
+        msg = f"Unknown decimation '{method}'"
+        raise ValueError(msg)
+
+    count = len(series[0])
+    if method == "none" or count <= points or len(series) < 2:
+        return series, envelopes
+
+    times = np.asarray(series[0], dtype="datetime64[ns]")
+    values = np.column_stack([np.asarray(x, dtype=np.float64) for x in series[1:]])
+
+    if method == "minmax":
+        index = minmax_indices(values, points // 2)
+    else:
+        index = lttb_indices(md.date2num(times), values, points)
+
+    decimated = [times[index]] + [values[index, x] for x in range(values.shape[1])]
+    if envelopes is not None:
+        envelopes = [(np.asarray(x)[index], np.asarray(y)[index]) for x, y in envelopes]
+
+    return decimated, envelopes
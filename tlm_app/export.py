@@ -0,0 +1,194 @@
+"""
+Streamed export of the stored telemetry as CSV or Parquet
+"""
+
+from __future__ import annotations
+
+import csv
+import importlib.util
+import io
+from datetime import datetime
+from typing import Iterable, Iterator
+from flask import request
+from .database import db
+from .layout import TELEMETRY_COLUMNS
+from .models import Channel
+from .partition import route_connection
+from .store import columns_statement, epoch_ns_storage, set_columns
+from .subsets import sets
+from .timestamp import SECOND_NS
+
+# pylint: disable=no-member
+
+EXPORT_FORMATS = ("csv", "parquet")
+MIMETYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+CHANNEL_COLUMN = "channel"
+
+
+def validate_export() -> tuple[str | None, str | None, int, str]:
+    """
+    Validate the export request: the route, the format and either
+    both the set and the channel or neither for the whole route.
+    """
+
+    tlm_set = request.args.get("set")
+    channel = request.args.get("channel")
+    route_time = request.args.get("route")
+    export_format = request.args.get("format", "csv")
+
+    if route_time is None or (tlm_set is None) != (channel is None):
+        msg = "Missing arguments"
+        raise ValueError(msg)
+
+    if tlm_set is not None and tlm_set not in sets:
+        msg = f"No such subset '{tlm_set}'"
+        raise ValueError(msg)
+
+    if export_format not in EXPORT_FORMATS:
+        msg = f"Unknown export format '{export_format}'"
+        raise ValueError(msg)
+
+    return tlm_set, channel, int(route_time), export_format
+
+
+def parquet_available() -> bool:
+    """
+    Check if pyarrow is installed to write Parquet.
+    """
+
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def export_channels(channel: str | None) -> list[tuple[int, str]]:
+    """
+    Ids and names of the channel, or of every channel.
+    """
+
+    stmt = db.select([Channel.id, Channel.name]).order_by(Channel.id)
+    if channel is not None:
+        stmt = stmt.where(Channel.name == channel)
+
+    channels = [tuple(x) for x in db.session.execute(stmt)]
+    if not channels:
+        msg = f"No such channel '{channel}'"
+        raise ValueError(msg)
+
+    return channels
+
+
+def export_columns(tlm_set: str | None) -> list[str]:
+    """
+    Table columns of the set, or the CU time and every value.
+    """
+
+    if tlm_set is not None:
+        return set_columns(tlm_set)
+
+    return ["cutime_ns" if epoch_ns_storage() else "cutime", *TELEMETRY_COLUMNS]
+
+
+def export_batches(
+    channels: list[tuple[int, str]], columns: list[str], route_time: int, size: int
+) -> Iterator[list[tuple]]:
+    """
+    Rows of the route, channel by channel in the CU time order, each
+    starting with the channel name. Rows are fetched in batches of
+    the size, so that only a batch is held in memory.
+    """
+
+    if epoch_ns_storage():
+        ft_t_on: datetime | int = route_time * SECOND_NS
+    else:
+        ft_t_on = datetime.fromtimestamp(route_time)
+
+    with db.engine.connect() as conn, route_connection(conn, ft_t_on) as source:
+        for channel_id, name in channels:
+            stmt = columns_statement(columns, channel_id, route_time)
+            result = source.execute(stmt.execution_options(yield_per=size))
+            for rows in result.partitions():
+                yield [(name, *x) for x in rows]
+
+
+def csv_chunks(columns: list[str], batches: Iterable[list[tuple]]) -> Iterator[bytes]:
+    """
+    CSV text of the header and then of every batch, encoded as UTF-8.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([CHANNEL_COLUMN, *columns])
+
+    yield buffer.getvalue().encode()
+
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Output stream keeping what was written until it is taken,
+    while reporting positions from the start of the stream.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        """
+        Get and forget what was written so far.
+        """
+
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parquet_chunks(
+    columns: list[str], batches: Iterable[list[tuple]]
+) -> Iterator[bytes]:
+    """
+    Parquet file with a row group per batch, sent as each one is written.
+    CU times stored as datetimes are local times, integer ones are UTC.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    if epoch_ns_storage():
+        time_type = pa.timestamp("ns", tz="UTC")
+    else:
+        time_type = pa.timestamp("us")
+    schema = pa.schema(
+        [(CHANNEL_COLUMN, pa.string()), (columns[0], time_type)]
+        + [(x, pa.float64()) for x in columns[1:]]
+    )
+
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in batches:
+            arrays = [
+                pa.array(data, type=field.type)
+                for data, field in zip(zip(*rows), schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+
+    yield sink.take()
@@ -0,0 +1,170 @@
+"""
+Frames validation and resynchronisation after damaged trace regions
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Generator
+import numpy as np
+from .ip import MAC_HEADER, IPV4_HEADER, PACKET_SIZE
+
+ETH_TYPE_OFF = MAC_HEADER - 2
+IPV4_VER_OFF = MAC_HEADER
+UDP_LEN_OFF = MAC_HEADER + IPV4_HEADER + 4
+
+# IPv4 Ethernet type followed by IP version 4 with a 20-byte header
+FRAME_SIGNATURE = (0x08, 0x00, 0x45)
+UDP_LEN = divmod(PACKET_SIZE - MAC_HEADER - IPV4_HEADER, 256)
+
+# Frames checked at once
+BLOCK_FRAMES = 4096
+# Bytes searched at once for the next frame
+SEARCH_WINDOW = 1 << 16
+
+
+@dataclass
+class FrameStats:
+    """
+    Valid frames and damaged regions of a trace
+    """
+
+    frames: int = 0
+    skipped_bytes: int = 0
+    skipped_frames: int = 0
+    first: int | None = None
+    end: int = 0
+
+    def skip(self, size: int) -> None:
+        """
+        Account for a damaged region, which takes up whole or partial frames.
+        """
+
+        if size > 0:
+            self.skipped_bytes += size
+            self.skipped_frames += -(-size // PACKET_SIZE)
+
+    def add_run(self, offset: int, count: int) -> None:
+        """
+        Account for a run of valid frames and the gap before it.
+        """
+
+        if self.first is None:
+            self.first = offset
+        else:
+            self.skip(offset - self.end)
+
+        self.frames += count
+        self.end = offset + count * PACKET_SIZE
+
+    def merge(self, other: FrameStats) -> None:
+        """
+        Add stats of the next trace range.
+        """
+
+        self.skipped_bytes += other.skipped_bytes
+        self.skipped_frames += other.skipped_frames
+        if other.first is not None:
+            self.add_run(other.first, 0)
+            self.frames += other.frames
+            self.end = other.end
+
+    def finish(self, size: int) -> None:
+        """
+        Account for the regions before the first and after the last frame.
+        """
+
+        if self.first is None:
+            self.skip(size)
+            return
+
+        self.skip(self.first)
+        self.skip(size - self.end)
+
+
+def valid_frames(frames: np.ndarray) -> np.ndarray:
+    """
+    Check Ethernet type, IPv4 version and header length and UDP length
+    of every frame of the block at once.
+    """
+
+    return (
+        (frames[:, ETH_TYPE_OFF] == FRAME_SIGNATURE[0])
+        & (frames[:, ETH_TYPE_OFF + 1] == FRAME_SIGNATURE[1])
+        & (frames[:, IPV4_VER_OFF] == FRAME_SIGNATURE[2])
+        & (frames[:, UDP_LEN_OFF] == UDP_LEN[0])
+        & (frames[:, UDP_LEN_OFF + 1] == UDP_LEN[1])
+    )
+
+
+def find_frame(data: np.ndarray, pos: int) -> int | None:
+    """
+    Find the start of the next valid whole frame at or after the position.
+    """
+
+    size = len(data)
+
+    while pos + PACKET_SIZE <= size:
+        window = data[pos + ETH_TYPE_OFF: pos + ETH_TYPE_OFF + SEARCH_WINDOW]
+        hits = np.flatnonzero(
+            (window[:-2] == FRAME_SIGNATURE[0])
+            & (window[1:-1] == FRAME_SIGNATURE[1])
+            & (window[2:] == FRAME_SIGNATURE[2])
+        )
+
+        for hit in hits.tolist():
+            start = pos + hit
+            if start + PACKET_SIZE > size:
+                return None
+            if valid_frames(data[start: start + PACKET_SIZE].reshape(1, -1))[0]:
+                return start
+
+        pos += max(len(window) - 2, 1)
+
+    return None
+
+
+def frame_runs(
+    view: memoryview, start: int, stop: int, stats: FrameStats
+) -> Generator[tuple[int, int], None, None]:
+    """
+    Give runs of valid frames starting within the range as (offset, count).
+    Frames are checked block by block as the runs are decoded, and after
+    a damaged region the next valid frame is searched for.
+    """
+
+    data = np.frombuffer(view, np.uint8)
+    size = len(data)
+    pos = start
+
+    while pos < stop and pos + PACKET_SIZE <= size:
+        count = min(
+            BLOCK_FRAMES,
+            (size - pos) // PACKET_SIZE,
+            -(-(stop - pos) // PACKET_SIZE),
+        )
+        block = data[pos: pos + count * PACKET_SIZE].reshape(count, PACKET_SIZE)
+        bad = np.flatnonzero(~valid_frames(block))
+        good = int(bad[0]) if len(bad) else count
+
+        if good:
+            stats.add_run(pos, good)
+            yield pos, good
+            pos += good * PACKET_SIZE
+
+        if good < count:
+            found = find_frame(data, pos + 1)
+            if found is None:
+                break
+            pos = found
+
+
+def iter_frames(
+    view: memoryview, stats: FrameStats
+) -> Generator[tuple[int, int], None, None]:
+    """
+    Give runs of valid frames of the whole trace as (offset, count).
+    """
+
+    yield from frame_runs(view, 0, len(view), stats)
+    stats.finish(len(view))
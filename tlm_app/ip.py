@@ -15,3 +15,6 @@ IP_OFF = MAC_HEADER + IPV4_HEADER - IP_SADDR - IP_DADDR
 
 # To find out where DATA is started, calculate its start position
 DATA_OFF = MAC_HEADER + IPV4_HEADER + UDP_HEADER + SEQ_ID
+
+# Every packet of a trace is a whole Ethernet frame of a fixed size
+PACKET_SIZE = 1092
@@ -0,0 +1,142 @@
+"""
+Background ingestion of uploaded traces
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from uuid import uuid4
+from flask import Flask
+from .ip import PACKET_SIZE
+from .framing import FrameStats
+from .packet import get_telemetry
+
+# Finished jobs kept to report their status
+JOBS_KEPT = 100
+
+
+@dataclass
+class Job:
+    """
+    Ingestion job state
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    filename: str
+    total: int
+    id: str = field(default_factory=lambda: uuid4().hex)
+    state: str = "queued"
+    packets: int = 0
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    classes: dict[str, int] = field(default_factory=dict)
+    frames: FrameStats = field(default_factory=FrameStats)
+
+    def update(self, packets: int) -> None:
+        """
+        Record the number of telemetry packets decoded so far.
+        """
+
+        self.packets = packets
+
+    def as_dict(self) -> dict:
+        """
+        Report the job state, progress and decoding rate.
+        Progress is approximate while running, since the total number
+        of packets includes CU packets and packets of unknown channels.
+        """
+
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or time.monotonic()) - self.started
+
+        if self.state == "done":
+            progress = 1.0
+        else:
+            progress = min(self.packets / self.total, 1.0) if self.total else 0.0
+
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "state": self.state,
+            "packets": self.packets,
+            "total": self.total,
+            "progress": progress,
+            "rate": self.packets / elapsed if elapsed else 0.0,
+            "error": self.error,
+            "classes": self.classes,
+            "skipped_bytes": self.frames.skipped_bytes,
+            "skipped_frames": self.frames.skipped_frames,
+        }
+
+
+class JobQueue:
+    """
+    Ingestion jobs run one by one in a background thread,
+    so request workers stay free while traces are decoded.
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="ingest")
+
+    def submit(self, path: str, filename: str) -> Job:
+        """
+        Queue the saved trace file for ingestion.
+        """
+
+        job = Job(filename, os.path.getsize(path) // PACKET_SIZE)
+
+        with self.lock:
+            self.jobs[job.id] = job
+            finished = [x.id for x in self.jobs.values() if x.finished is not None]
+            for job_id in finished[: max(len(self.jobs) - JOBS_KEPT, 0)]:
+                del self.jobs[job_id]
+
+        self.executor.submit(self.run, job, path)
+
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Find the job by its id.
+        """
+
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self, job: Job, path: str) -> None:
+        """
+        Ingest the trace and remove the file afterwards.
+        """
+
+        # pylint: disable=logging-fstring-interpolation
+
+        job.state = "running"
+        job.started = time.monotonic()
+
+        with self.app.app_context():
+            try:
+                job.packets = get_telemetry(
+                    path, job.update, job.classes, job.frames
+                )
+                job.state = "done"
+                self.app.logger.info(
+                    f"Job {job.id}: added {job.packets} packets to the database"
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                job.state = "failed"
+                job.error = str(err)
+                self.app.logger.exception(f"Job {job.id} failed")
+            finally:
+                job.finished = time.monotonic()
+                os.remove(path)
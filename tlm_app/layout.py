@@ -0,0 +1,265 @@
+"""
+Declarative packet layout compiled into fused decoders
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from struct import Struct, calcsize
+from typing import Callable, Generator, Iterable, Sequence
+from .ip import IP_OFF, DATA_OFF, PACKET_SIZE
+from .cu import CUTIME_OFF
+from .cu_unit import CU_UNIT_OFF, T_ON_OFF
+from .channel import CU, UNKNOWN, CU_SUB_TYPE, Classifier
+from .brd import BRD_OFF, BRD_TEMP_UNIT
+from .chg import CHG_OFF, CHG_CUR_UNIT, CHG_VSDIV_UNIT, CHG_VTDIV_UNIT
+from .ldd import LDD_OFF, LDD_TEMP_UNIT, LDD_VOLT_UNIT, NO_ADJUSTMENTS
+from .pls import PLS_OFF, PLS_VOLT_UNIT, PLS_CUR_UNIT
+from .timestamp import (
+    timestamp_to_unixtime,
+    ton_to_unixtime,
+    timestamp_to_epoch_ns,
+    ton_to_epoch_ns,
+)
+
+# Celsius from Kelvin
+KELVIN = -273
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    Packet field: its offset, raw struct type and the linear scaling
+    'scale * raw + bias', plus an optional per-channel RT adjustment index
+    """
+
+    name: str
+    offset: int
+    raw: str
+    scale: float = 1
+    bias: float = 0
+    adjustment: int | None = None
+
+    @property
+    def size(self) -> int:
+        """
+        Raw field size in bytes.
+        """
+
+        return calcsize("<" + self.raw)
+
+
+HEADER_FIELDS = (
+    Field("ip", IP_OFF, "4s"),
+    Field("sub_type", DATA_OFF + 8, "H"),
+    Field("cutime", CUTIME_OFF, "Q"),
+)
+
+CU_FIELDS = (Field("ft_t_on", CU_UNIT_OFF + T_ON_OFF, "I"),)
+
+# Ordered as the telemetry table columns
+TELEMETRY_FIELDS = (
+    Field("brd_lt1", BRD_OFF, "H", BRD_TEMP_UNIT, KELVIN),
+    Field("brd_lt2", BRD_OFF + 2, "H", BRD_TEMP_UNIT, KELVIN),
+    Field("brd_lt3", BRD_OFF + 4, "H", BRD_TEMP_UNIT, KELVIN),
+    Field("brd_lt4", BRD_OFF + 6, "H", BRD_TEMP_UNIT, KELVIN),
+    Field("chg_vtcur1", CHG_OFF, "H", CHG_CUR_UNIT),
+    Field("chg_vscur", CHG_OFF + 4, "H", CHG_CUR_UNIT),
+    Field("chg_vsdiv", CHG_OFF + 6, "H", CHG_VSDIV_UNIT),
+    Field("chg_vtdiv1", CHG_OFF + 8, "H", CHG_VTDIV_UNIT),
+    Field("ldd_hv1", LDD_OFF, "H", LDD_VOLT_UNIT),
+    Field("ldd_ldout1", LDD_OFF + 4, "H", LDD_VOLT_UNIT),
+    Field("ldd_lt1", LDD_OFF + 10, "H", LDD_TEMP_UNIT, KELVIN),
+    Field("ldd_lt2", LDD_OFF + 12, "H", LDD_TEMP_UNIT, KELVIN),
+    Field("ldd_lt3", LDD_OFF + 14, "H", LDD_TEMP_UNIT, KELVIN),
+    Field("ldd_rt1", LDD_OFF + 16, "H", LDD_TEMP_UNIT, KELVIN, 0),
+    Field("ldd_rt2", LDD_OFF + 20, "H", LDD_TEMP_UNIT, KELVIN, 1),
+    Field("ldd_rt3", LDD_OFF + 24, "H", LDD_TEMP_UNIT, KELVIN, 2),
+    Field("pls_hvr1", PLS_OFF, "H", PLS_VOLT_UNIT),
+    Field("pls_ldr1", PLS_OFF + 2, "H", PLS_VOLT_UNIT),
+    Field("pls_ldr2", PLS_OFF + 4, "H", PLS_VOLT_UNIT),
+    Field("pls_hvr2", PLS_OFF + 6, "H", PLS_VOLT_UNIT),
+    Field("pls_i1", PLS_OFF + 8, "H", PLS_CUR_UNIT),
+    Field("pls_ld1", PLS_OFF + 10, "H", PLS_VOLT_UNIT),
+    Field("pls_ld2", PLS_OFF + 12, "H", PLS_VOLT_UNIT),
+    Field("pls_i2", PLS_OFF + 14, "H", PLS_CUR_UNIT),
+    Field("pls_i3", PLS_OFF + 16, "H", PLS_CUR_UNIT),
+    Field("pls_ld3", PLS_OFF + 18, "H", PLS_VOLT_UNIT),
+    Field("pls_ld4", PLS_OFF + 20, "H", PLS_VOLT_UNIT),
+    Field("pls_i4", PLS_OFF + 22, "H", PLS_CUR_UNIT),
+    Field("pls_hvf1", PLS_OFF + 24, "H", PLS_VOLT_UNIT),
+    Field("pls_ldf1", PLS_OFF + 26, "H", PLS_VOLT_UNIT),
+    Field("pls_ldf2", PLS_OFF + 28, "H", PLS_VOLT_UNIT),
+    Field("pls_hvf2", PLS_OFF + 30, "H", PLS_VOLT_UNIT),
+)
+
+TELEMETRY_COLUMNS = tuple(x.name for x in TELEMETRY_FIELDS)
+ROW_COLUMNS = ("channel_id", "cutime", "ft_t_on") + TELEMETRY_COLUMNS
+NS_ROW_COLUMNS = ("channel_id", "cutime_ns", "ft_t_on_ns") + TELEMETRY_COLUMNS
+
+# CU timestamp and route converters by the time storage
+TIME_CONVERTERS: dict[
+    str, tuple[Callable[[int], datetime | int], Callable[[int], datetime | int]]
+] = {
+    "datetime": (timestamp_to_unixtime, ton_to_unixtime),
+    "epoch_ns": (timestamp_to_epoch_ns, ton_to_epoch_ns),
+}
+
+
+def row_columns(time_storage: str) -> tuple[str, ...]:
+    """
+    Table columns of the decoded rows for the time storage.
+    """
+
+    if time_storage not in TIME_CONVERTERS:
+        msg = f"Unknown time storage '{time_storage}'"
+        raise ValueError(msg)
+
+    return NS_ROW_COLUMNS if time_storage == "epoch_ns" else ROW_COLUMNS
+
+
+def field_expression(field: Field, index: int) -> str:
+    """
+    Python expression computing the field value from the unpacked tuple.
+    """
+
+    expr = f"raw[{index}]"
+    if field.scale != 1:
+        expr = f"{field.scale!r} * {expr}"
+    if field.bias:
+        expr = f"{expr} + {field.bias!r}"
+    if field.adjustment is not None:
+        expr = f"{expr} + adj[{field.adjustment}]"
+
+    return expr
+
+
+class Layout:
+    """
+    Fields compiled once into a single struct covering the whole packet
+    and a generated builder of the scaled row.
+    Fields must not overlap.
+    """
+
+    def __init__(self, fields: Sequence[Field], values: Sequence[Field]):
+        self.fields = sorted(fields, key=lambda x: x.offset)
+        self.index = {x.name: num for num, x in enumerate(self.fields)}
+        self.struct = Struct(self.compile_format())
+        self.build_row = self.compile_row_builder(values)
+
+    def compile_format(self) -> str:
+        """
+        Join field types with the pad bytes between them.
+        """
+
+        fmt = "<"
+        pos = 0
+        for field in self.fields:
+            if field.offset < pos:
+                msg = f"Field '{field.name}' overlaps the previous one"
+                raise ValueError(msg)
+            if field.offset > pos:
+                fmt += f"{field.offset - pos}x"
+            fmt += field.raw
+            pos = field.offset + field.size
+
+        # Pad to the whole packet, so that a trace can be iterated over
+        if pos < PACKET_SIZE:
+            fmt += f"{PACKET_SIZE - pos}x"
+
+        return fmt
+
+    def compile_row_builder(
+        self, values: Sequence[Field]
+    ) -> Callable[[tuple, tuple], tuple]:
+        """
+        Generate a function scaling the unpacked tuple into the values row.
+        """
+
+        # pylint: disable=exec-used
+
+        exprs = [field_expression(x, self.index[x.name]) for x in values]
+        source = f"def build_row(raw, adj):\n    return ({', '.join(exprs)},)\n"
+        namespace: dict = {}
+        exec(source, namespace)
+
+        return namespace["build_row"]
+
+
+PACKET_LAYOUT = Layout(HEADER_FIELDS + TELEMETRY_FIELDS, TELEMETRY_FIELDS)
+CU_LAYOUT = Layout(CU_FIELDS, CU_FIELDS)
+
+# Builders of the values row by the value storage,
+# raw ADC counts are calibrated when they are read
+ROW_BUILDERS = {
+    "calibrated": PACKET_LAYOUT.build_row,
+    "counts": PACKET_LAYOUT.compile_row_builder(
+        [Field(x.name, x.offset, x.raw) for x in TELEMETRY_FIELDS]
+    ),
+}
+
+
+def decode_rows(
+    view: memoryview,
+    runs: Iterable[tuple[int, int]],
+    classifier: Classifier,
+    adjustments: dict[int, tuple],
+    counts: Counter,
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> Generator[tuple, None, datetime | int | None]:
+    """
+    Decode runs of whole packets, given as (offset, count), into rows
+    ordered as 'row_columns(time_storage)', with one unpack call and
+    one class lookup per packet. Values are scaled unless raw counts
+    are stored. Packets are counted by class.
+    Channels without RT adjustments in the database are not adjusted.
+    Packets before the first CU packet get no route.
+    Return the route of the last CU packet.
+    """
+
+    # pylint: disable=too-many-locals,too-many-arguments
+
+    ip_index = PACKET_LAYOUT.index["ip"]
+    sub_type_index = PACKET_LAYOUT.index["sub_type"]
+    cutime_index = PACKET_LAYOUT.index["cutime"]
+    build_row = ROW_BUILDERS[value_storage]
+    to_cutime, to_route = TIME_CONVERTERS[time_storage]
+    classes = classifier.classes
+    ft_t_on = None
+
+    for offset, count in runs:
+        frames = view[offset: offset + count * PACKET_SIZE]
+        unpacked = PACKET_LAYOUT.struct.iter_unpack(frames)
+        try:
+            for num, raw in enumerate(unpacked):
+                kind = classes.get(raw[ip_index], UNKNOWN)
+
+                if kind == CU:
+                    if raw[sub_type_index] == CU_SUB_TYPE:
+                        counts[CU] += 1
+                        (t_on,) = CU_LAYOUT.struct.unpack_from(
+                            frames, num * PACKET_SIZE
+                        )
+                        ft_t_on = to_route(t_on)
+                        continue
+                    kind = UNKNOWN
+
+                counts[kind] += 1
+                if kind == UNKNOWN:
+                    continue
+
+                yield (
+                    kind,
+                    to_cutime(raw[cutime_index]),
+                    ft_t_on,
+                ) + build_row(raw, adjustments.get(kind, NO_ADJUSTMENTS))
+        finally:
+            # The iterator holds the frames, so it is dropped before they are
+            # released, or a decoding error would be lost to a BufferError
+            del unpacked
+            frames.release()
+
+    return ft_t_on
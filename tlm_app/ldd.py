@@ -9,7 +9,6 @@ from struct import unpack_from
 from .ip import DATA_OFF
 from .database import db
 from .models import Adjustment
-from .channel import get_ltu_channel
 
 
 LDD_PAYLOAD_FMT = "<H2xH4x4H2xH2xH"
@@ -19,6 +18,8 @@ LDD_VOLT_UNIT = 108e-3
 
 
 RT_ADJUSTMENTS = {}
+# RT adjustments of a channel missing from the database
+NO_ADJUSTMENTS = (0.0, 0.0, 0.0)
 
 
 @dataclass
@@ -50,20 +51,21 @@ class LddTelemetry:
             RT_ADJUSTMENTS[rec.channel_id] = rec.ldd_rt1, rec.ldd_rt2, rec.ldd_rt3
 
     @staticmethod
-    def load_from_packet(packet: bytes) -> LddTelemetry:
+    def load_from_packet(packet: bytes | memoryview, channel_id: int) -> LddTelemetry:
         """
-        Get LDD voltages and temperatures.
+        Get LDD voltages and temperatures with the RT adjustments of the channel,
+        if it has any.
         """
 
         if not RT_ADJUSTMENTS:
             LddTelemetry.init_dct()
 
-        channel_id = get_ltu_channel(packet)
+        adjustments = RT_ADJUSTMENTS.get(channel_id, NO_ADJUSTMENTS)
         ldd = unpack_from(LDD_PAYLOAD_FMT, packet, LDD_OFF)
         hv1, ldout1 = map(lambda x: LDD_VOLT_UNIT * x, ldd[0:2])
         lt1, lt2, lt3 = map(lambda x: LDD_TEMP_UNIT * x - 273, ldd[2:5])
-        rt1 = LDD_TEMP_UNIT * ldd[5] - 273 + RT_ADJUSTMENTS[channel_id][0]
-        rt2 = LDD_TEMP_UNIT * ldd[6] - 273 + RT_ADJUSTMENTS[channel_id][1]
-        rt3 = LDD_TEMP_UNIT * ldd[7] - 273 + RT_ADJUSTMENTS[channel_id][2]
+        rt1 = LDD_TEMP_UNIT * ldd[5] - 273 + adjustments[0]
+        rt2 = LDD_TEMP_UNIT * ldd[6] - 273 + adjustments[1]
+        rt3 = LDD_TEMP_UNIT * ldd[7] - 273 + adjustments[2]
 
         return LddTelemetry(hv1, ldout1, lt1, lt2, lt3, rt1, rt2, rt3)
@@ -2,13 +2,27 @@
 Database definition and access
 """
 
+from __future__ import annotations
+
 import sqlite3
-from dataclasses import astuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Sequence
 from flask import current_app
 from flask import g
+from sqlalchemy.engine import make_url
+from .calibration import channel_adjustments, counts_storage, value_sql
+from .database import apply_pragmas, bulk_pragmas
+from .layout import row_columns
+from .store import Page, epoch_ns_storage, route_entry, set_columns
+from .timestamp import SECOND_NS
 
 # pylint: disable=invalid-name
 
+TABLE = "telemetry"
+# Datetimes are kept as SQLAlchemy keeps them, so both stores share the table
+DATETIME_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
 
 def get_db():
     """
@@ -18,9 +32,13 @@ def get_db():
     """
 
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
+        path = make_url(current_app.config["SQLALCHEMY_DATABASE_URI"]).database
+        if not path:
+            msg = "The raw SQLite store needs a database file"
+            raise ValueError(msg)
+
+        g.db = sqlite3.connect(path)
+        apply_pragmas(g.db, current_app.config["TLM_SQLITE_PRAGMAS"])
 
     return g.db
 
@@ -47,60 +65,180 @@ def init_app(app):
     app.teardown_appcontext(close_db)
 
 
-def drop_table(conn, data: dict[str, list[tuple]]) -> None:
+def insert_into_table(conn, columns: Sequence[str], rows: Sequence[tuple]) -> int:
     """
-    Remove the table only if the table exists.
-    Otherwise, it just ignores the statement and does nothing.
+    Insert telemetry rows into the table with one executemany call,
+    skipping packets already stored. Return the number of inserted rows.
     """
-    # Use a dictionary key as a table name
-    for key in data:
-        drop_script = f"DROP TABLE IF EXISTS {key}"
-        conn.cursor().execute(drop_script)
 
+    insert_script = (
+        f"INSERT OR IGNORE INTO {TABLE} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
 
-def create_table(conn, data: dict[str, list[tuple]]) -> None:
+    return conn.executemany(insert_script, rows).rowcount
+
+
+def format_datetime(value: datetime | None) -> str | None:
     """
-    Create a table to keep LTU telemetry data.
+    Format the local time as it is stored.
     """
 
-    for key in data:
-        create_script = f"""CREATE TABLE {key}(
-        id integer PRIMARY KEY,
-        cutime integer, brd_lt1 real, brd_lt2 real, brd_lt3 real, brd_lt4 real,
-        chg_vtcur1 real, chg_vscur real, chg_vsdiv real, chg_vtdiv1 real,
-        ldd_hv1 real, ldd_ldout1 real, ldd_lt1 real, ldd_lt2 real, ldd_lt3 real,
-        ldd_rt1 real, ldd_rt2 real, ldd_rt3 real, pls_hvr1 real, pls_ldr1 real,
-        pls_ldr2 real, pls_hvr2 real, pls_i1 real, pls_ld1 real, pls_ld2 real,
-        pls_i2 real, pls_i3 real, pls_ld3 real, pls_ld4 real, pls_i4 real,
-        pls_hvf1 real, pls_ldf1 real, pls_ldf2 real, pls_hvf2 real
-        )"""
+    return None if value is None else value.strftime(DATETIME_FMT)
+
+
+def parse_datetime(value: str | None) -> datetime | None:
+    """
+    Parse the stored local time.
+    """
 
-        conn.cursor().execute(create_script)
+    return None if value is None else datetime.fromisoformat(value)
 
 
-def insert_into_table(conn, data: dict[str, list[tuple]]) -> None:
+class SqliteStore:
     """
-    Insert telemetry data into a table.
+    Telemetry table accessed with the sqlite3 module directly
     """
 
-    for key, value in data.items():
-        insert_script = f"""INSERT INTO {key}(
-        cutime, brd_lt1, brd_lt2, brd_lt3, brd_lt4,
-        chg_vtcur1, chg_vscur, chg_vsdiv, chg_vtdiv1,
-        ldd_hv1, ldd_ldout1, ldd_lt1, ldd_lt2, ldd_lt3,
-        ldd_rt1, ldd_rt2, ldd_rt3, pls_hvr1, pls_ldr1,
-        pls_ldr2, pls_hvr2, pls_i1, pls_ld1, pls_ld2,
-        pls_i2, pls_i3, pls_ld3, pls_ld4, pls_i4,
-        pls_hvf1, pls_ldf1, pls_ldf2, pls_hvf2)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-
-        for row in value:
-            conn.cursor().execute(
-                insert_script,
-                (int(row[0]),)
-                + astuple(row[1])
-                + astuple(row[2])
-                + astuple(row[3])
-                + astuple(row[4]),
-            )
+    def __init__(self):
+        self.columns = row_columns(current_app.config["TLM_TIME_STORAGE"])
+        self.epoch_ns = epoch_ns_storage()
+
+    @contextmanager
+    def ingest(self, replace: bool) -> Iterator[None]:
+        """
+        Write over the app context connection with the bulk ingest profile.
+        """
+
+        conn = get_db()
+        with bulk_pragmas(conn):
+            try:
+                if replace:
+                    conn.execute(f"DELETE FROM {TABLE}")
+                yield
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def format_rows(self, rows: Sequence[tuple]) -> Sequence[tuple]:
+        """
+        Integer times are passed as they are, datetimes are formatted.
+        """
+
+        if self.epoch_ns:
+            return rows
+
+        return [
+            (x[0], format_datetime(x[1]), format_datetime(x[2])) + x[3:] for x in rows
+        ]
+
+    def write_batch(self, rows: Sequence[tuple]) -> int:
+        """
+        Insert the rows with one executemany call.
+        """
+
+        conn = get_db()
+        inserted = insert_into_table(conn, self.columns, self.format_rows(rows))
+        conn.commit()
+
+        return inserted
+
+    def query_table(
+        self,
+        conn,
+        table: str,
+        tlm_set: str,
+        channel_id: int,
+        route_time: int,
+        page: Page | None = None,
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the set columns of the channel route from the table,
+        or a keyset page of them followed by the row ids.
+        Values stored as counts are calibrated by the query.
+        """
+
+        # pylint: disable=too-many-arguments,too-many-locals
+
+        columns = set_columns(tlm_set)
+        if self.epoch_ns:
+            route_column, cutime_column = "ft_t_on_ns", "cutime_ns"
+            route: int | str | None = route_time * SECOND_NS
+        else:
+            route_column, cutime_column = "ft_t_on", "cutime"
+            route = format_datetime(datetime.fromtimestamp(route_time))
+
+        selected = columns
+        params: list = []
+        if counts_storage():
+            adjustments = channel_adjustments(channel_id)
+            selected = []
+            for name in columns:
+                sql, column_params = value_sql(name, adjustments)
+                selected.append(sql)
+                params += column_params
+        if page is not None:
+            selected = [*selected, "id"]
+
+        sql = (
+            f"SELECT {', '.join(selected)} FROM {table} "
+            f"WHERE channel_id = ? AND {route_column} = ?"
+        )
+        params += [channel_id, route]
+        if page is None:
+            sql += f" ORDER BY {cutime_column}"
+        else:
+            direction = " DESC" if page.backward else ""
+            if page.cursor is not None:
+                cutime, row_id = page.cursor
+                # Datetimes are compared as they are stored, as text
+                if isinstance(cutime, datetime):
+                    params += [format_datetime(cutime), row_id]
+                else:
+                    params += [cutime, row_id]
+                compare = "<" if page.backward else ">"
+                sql += f" AND ({cutime_column}, id) {compare} (?, ?)"
+            sql += f" ORDER BY {cutime_column}{direction}, id{direction} LIMIT ?"
+            params.append(page.limit)
+
+        rows = conn.execute(sql, params)
+        if self.epoch_ns:
+            return list(rows), columns
+
+        return [(parse_datetime(x[0]),) + x[1:] for x in rows], columns
+
+    def query_series(
+        self, tlm_set: str, channel_id: int, route_time: int
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the set columns with the app context connection.
+        """
+
+        return self.query_table(get_db(), TABLE, tlm_set, channel_id, route_time)
+
+    def query_page(
+        self, tlm_set: str, channel_id: int, route_time: int, page: Page
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the keyset page with the app context connection.
+        """
+
+        return self.query_table(
+            get_db(), TABLE, tlm_set, channel_id, route_time, page
+        )
+
+    def list_routes(self) -> list[tuple[int, datetime]]:
+        """
+        Query the routes with the app context connection.
+        """
+
+        route_column = "ft_t_on_ns" if self.epoch_ns else "ft_t_on"
+        rows = get_db().execute(
+            f"SELECT DISTINCT {route_column} FROM {TABLE} "
+            f"WHERE {route_column} IS NOT NULL"
+        )
+        if self.epoch_ns:
+            return [route_entry(x) for (x,) in rows]
+
+        return [route_entry(datetime.fromisoformat(x)) for (x,) in rows]
@@ -10,6 +10,9 @@ from .database import db
 
 BaseModel: DefaultMeta = db.Model
 
+SUBSYSTEMS = ("brd", "chg", "ldd", "pls")
+ROLLUP_STATS = ("min", "max", "mean")
+
 # pylint: disable=too-few-public-methods,no-member
 
 
@@ -43,10 +46,58 @@ class Telemetry(BaseModel):
 
     # pylint: disable=too-many-arguments
 
+    # A packet is identified by its channel and CU time, in either storage.
+    # Indexes of a time storage leave out the rows of the other one,
+    # whose times are NULL, so that they cost nothing there
+    __table_args__ = (
+        db.Index(
+            "ix_telemetry_channel_cutime",
+            "channel_id",
+            "cutime",
+            unique=True,
+            sqlite_where=db.text("cutime IS NOT NULL"),
+        ),
+        db.Index(
+            "ix_telemetry_channel_cutime_ns",
+            "channel_id",
+            "cutime_ns",
+            unique=True,
+            sqlite_where=db.text("cutime_ns IS NOT NULL"),
+        ),
+        # Route data in the CU time order and the list of routes
+        db.Index(
+            "ix_telemetry_channel_route",
+            "channel_id",
+            "ft_t_on",
+            "cutime",
+            sqlite_where=db.text("ft_t_on IS NOT NULL"),
+        ),
+        db.Index(
+            "ix_telemetry_route",
+            "ft_t_on",
+            sqlite_where=db.text("ft_t_on IS NOT NULL"),
+        ),
+        db.Index(
+            "ix_telemetry_channel_route_ns",
+            "channel_id",
+            "ft_t_on_ns",
+            "cutime_ns",
+            sqlite_where=db.text("ft_t_on_ns IS NOT NULL"),
+        ),
+        db.Index(
+            "ix_telemetry_route_ns",
+            "ft_t_on_ns",
+            sqlite_where=db.text("ft_t_on_ns IS NOT NULL"),
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     channel_id = db.Column(db.Integer, db.ForeignKey("channel.id"))
     cutime = db.Column(db.DateTime)
     ft_t_on = db.Column(db.DateTime)
+    # Unix times in nanoseconds, for the "epoch_ns" time storage
+    cutime_ns = db.Column(db.BigInteger)
+    ft_t_on_ns = db.Column(db.BigInteger)
     brd_lt1 = db.Column(db.Float)
     brd_lt2 = db.Column(db.Float)
     brd_lt3 = db.Column(db.Float)
@@ -131,3 +182,38 @@ class Telemetry(BaseModel):
             pls_ldf2=pls.ldf2,
             pls_hvf2=pls.hvf2,
         )
+
+
+# Min, max and mean of every telemetry value per time bucket of each level,
+# for the routes of either time storage
+ROLLUP_VALUES = [
+    x.name for x in Telemetry.__table__.columns if x.name[:3] in SUBSYSTEMS
+]
+
+rollup = db.Table(
+    "rollup",
+    db.Column("id", db.Integer, primary_key=True),
+    # bucket length in seconds
+    db.Column("level", db.Integer, nullable=False),
+    db.Column("channel_id", db.Integer, db.ForeignKey("channel.id")),
+    db.Column("ft_t_on", db.DateTime),
+    db.Column("ft_t_on_ns", db.BigInteger),
+    # bucket start as the CU time in seconds divided by the level
+    db.Column("bucket", db.Integer, nullable=False),
+    db.Column("count", db.Integer),
+    *(
+        db.Column(f"{name}_{stat}", db.Float)
+        for name in ROLLUP_VALUES
+        for stat in ROLLUP_STATS
+    ),
+    db.Index("ix_rollup_route", "level", "channel_id", "ft_t_on", "bucket"),
+    db.Index("ix_rollup_route_ns", "level", "channel_id", "ft_t_on_ns", "bucket"),
+)
+
+# Data generation of the result caches, shared by every process of the app:
+# a single row whose value is increased whenever the stored telemetry changes
+generation = db.Table(
+    "generation",
+    db.Column("id", db.Integer, primary_key=True),
+    db.Column("value", db.BigInteger, nullable=False),
+)
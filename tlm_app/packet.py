@@ -2,57 +2,292 @@
 Packets reading
 """
 
-from typing import BinaryIO
+from collections import Counter
+from dataclasses import astuple
+from mmap import mmap
+from typing import Callable, Iterator
 from flask import current_app
-from .models import Telemetry
-from .database import db
-from .channel import get_ltu_channel, is_cu_packet
+from .channel import CU, UNKNOWN, CLASSIFIER
 from .cu import get_cutime
 from .brd import BrdTelemetry
 from .chg import ChgTelemetry
-from .ldd import LddTelemetry
+from .ldd import RT_ADJUSTMENTS, LddTelemetry
 from .pls import PlsTelemetry
 from .cu_unit import CUTelemetry
+from .ip import PACKET_SIZE
+from .layout import ROW_BUILDERS, decode_rows
+from .bulk import decode_trace
+from .framing import FrameStats, iter_frames
+from .parallel import read_parallel
+from .trace import map_trace, iter_packets
+from .columnar import ColumnWriter, clear_store
+from .store import get_store
+from .cache import get_cache
+from .rollup import update_rollups
 
+# Number of packets between progress reports
+PROGRESS_STEP = 4096
 
-PACKET_SIZE = 1092
 
+def init_tables() -> None:
+    """
+    Load the packet classes and RT adjustments from the db once.
+    """
+
+    if not CLASSIFIER.classes:
+        CLASSIFIER.load()
 
-def get_telemetry(file: BinaryIO) -> int:
+    if not RT_ADJUSTMENTS:
+        LddTelemetry.init_dct()
+
+
+def read_dataclasses(
+    data: bytes | mmap,
+    counts: Counter,
+    stats: FrameStats,
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> Iterator[tuple]:
     """
-    Get number of telemetry packets.
+    Decode the trace packet by packet with the subsystem records.
+    The records keep times as datetimes and scaled values only.
     """
 
-    # pylint: disable=no-member
+    if time_storage != "datetime":
+        msg = f"The dataclass decoder cannot store '{time_storage}' times"
+        raise ValueError(msg)
 
-    count = 0
-    db.session.execute(db.delete(Telemetry))
-    current_app.logger.info("Deleting existing records from the database")
+    if value_storage != "calibrated":
+        msg = f"The dataclass decoder cannot store '{value_storage}' values"
+        raise ValueError(msg)
 
+    init_tables()
     ft_t_on = None
 
-    while packet := file.read(PACKET_SIZE):
+    for packet in iter_packets(data, stats):
+        channel_id = CLASSIFIER.classify(packet)
+        counts[channel_id] += 1
 
-        if is_cu_packet(packet):
+        if channel_id == CU:
             ft_t_on = CUTelemetry.load_from_packet(packet).ft_t_on
             continue
 
-        try:
-            channel_id = get_ltu_channel(packet)
-        except KeyError:
+        if channel_id == UNKNOWN:
             continue
 
         cutime = get_cutime(packet)
 
         brd = BrdTelemetry.load_from_packet(packet)
         chg = ChgTelemetry.load_from_packet(packet)
-        ldd = LddTelemetry.load_from_packet(packet)
+        ldd = LddTelemetry.load_from_packet(packet, channel_id)
         pls = PlsTelemetry.load_from_packet(packet)
 
-        tlm = Telemetry.from_columns(channel_id, cutime, ft_t_on, brd, chg, ldd, pls)
-        db.session.add(tlm)
-        count += 1
+        yield (
+            (channel_id, cutime, ft_t_on)
+            + astuple(brd)
+            + astuple(chg)
+            + astuple(ldd)
+            + astuple(pls)
+        )
+
+
+def read_packets(
+    data: bytes | mmap,
+    counts: Counter,
+    stats: FrameStats,
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> Iterator[tuple]:
+    """
+    Decode the trace packet by packet, with one unpack call per LTU packet.
+    """
+
+    with memoryview(data) as view:
+        runs = iter_frames(view, stats)
+        try:
+            yield from decode_rows(
+                view,
+                runs,
+                CLASSIFIER,
+                RT_ADJUSTMENTS,
+                counts,
+                time_storage,
+                value_storage,
+            )
+        finally:
+            # The frame search holds the view until it is closed
+            runs.close()
+
+
+def read_trace(
+    data: bytes | mmap,
+    counts: Counter,
+    stats: FrameStats,
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> Iterator[tuple]:
+    """
+    Decode every run of valid frames at once, column by column.
+    """
+
+    ft_t_on = None
+
+    with memoryview(data) as view:
+        for offset, count in iter_frames(view, stats):
+            with view[offset: offset + count * PACKET_SIZE] as frames:
+                columns, ft_t_on = decode_trace(
+                    frames,
+                    ft_t_on,
+                    CLASSIFIER,
+                    RT_ADJUSTMENTS,
+                    counts,
+                    time_storage,
+                    value_storage,
+                )
+
+            yield from zip(*columns.values())
+
+
+def read_telemetry(path: str, counts: Counter, stats: FrameStats) -> Iterator[tuple]:
+    """
+    Decode the trace file with the configured decoder into flat rows,
+    ordered as 'row_columns' of the configured time storage, with values
+    of the configured value storage.
+    """
+
+    init_tables()
+
+    time_storage = current_app.config["TLM_TIME_STORAGE"]
+    value_storage = current_app.config["TLM_VALUE_STORAGE"]
+    if value_storage not in ROW_BUILDERS:
+        msg = f"Unknown value storage '{value_storage}'"
+        raise ValueError(msg)
+
+    workers = current_app.config["TLM_INGEST_WORKERS"]
+    if workers > 1:
+        chunk = current_app.config["TLM_INGEST_CHUNK"]
+        yield from read_parallel(
+            path,
+            workers,
+            chunk,
+            CLASSIFIER,
+            RT_ADJUSTMENTS,
+            counts,
+            stats,
+            time_storage,
+            value_storage,
+        )
+        return
+
+    decoder = current_app.config["TLM_DECODER"]
+    if decoder == "numpy":
+        read = read_trace
+    elif decoder == "packet":
+        read = read_packets
+    elif decoder == "dataclass":
+        read = read_dataclasses
+    else:
+        msg = f"Unknown decoder '{decoder}'"
+        raise ValueError(msg)
+
+    with map_trace(path) as data:
+        yield from read(data, counts, stats, time_storage, value_storage)
+
+
+def get_telemetry(
+    path: str,
+    progress: Callable[[int], None] | None = None,
+    classes: dict[str, int] | None = None,
+    stats: FrameStats | None = None,
+) -> int:
+    """
+    Get number of telemetry packets from the trace file.
+    The progress callback gets the number of packets decoded so far.
+    Packet counts by class name are put into the classes dictionary,
+    valid frames and skipped damaged regions are counted in the stats.
+    Rows are inserted into the configured telemetry store and committed
+    in batches of TLM_INSERT_BATCH rows.
+    Existing records are deleted first in the "replace" ingest mode and kept
+    in the "append" one; packets already stored are not inserted again.
+    The columnar store, if enabled, is written in the "replace" mode only.
+    Rollups of the ingested routes are recomputed afterwards.
+    The data generation of the result cache is increased on every commit.
+    """
+
+    # pylint: disable=no-member,logging-fstring-interpolation
+    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+
+    count = 0
+    counts: Counter = Counter()
+    if stats is None:
+        stats = FrameStats()
+    batch_size = current_app.config["TLM_INSERT_BATCH"]
+    mode = current_app.config["TLM_INGEST_MODE"]
+    inserted = 0
+    routes: set = set()
+
+    if mode not in ("replace", "append"):
+        msg = f"Unknown ingest mode '{mode}'"
+        raise ValueError(msg)
+
+    init_tables()
+    store = get_store()
+
+    # The columnar store is rewritten by a whole trace only,
+    # otherwise readers use the database
+    writer = None
+    if current_app.config["TLM_COLUMNAR"]:
+        clear_store(current_app.config["TLM_COLUMNAR_FOLDER"])
+        if mode == "replace":
+            writer = ColumnWriter(current_app.config["TLM_COLUMNAR_FOLDER"])
+
+    # Cached results are dropped with every commit and once the stored
+    # data are complete, whether the ingest succeeds or not
+    cache = get_cache()
+    try:
+        with store.ingest(replace=mode == "replace"):
+            if mode == "replace":
+                current_app.logger.info("Deleting existing records from the database")
+
+            batch: list[tuple] = []
+            for row in read_telemetry(path, counts, stats):
+                batch.append(row)
+                routes.add(row[2])
+                if writer is not None:
+                    writer.add(row)
+                count += 1
+                if progress is not None and not count % PROGRESS_STEP:
+                    progress(count)
+
+                # Committed batch by batch, so that memory use is bounded
+                if len(batch) >= batch_size:
+                    inserted += store.write_batch(batch)
+                    cache.bump()
+                    batch = []
+                    if writer is not None:
+                        writer.flush()
+
+            if batch:
+                inserted += store.write_batch(batch)
+
+        if writer is not None:
+            writer.finish()
+
+        routes.discard(None)
+        update_rollups(routes, mode == "replace")
+    finally:
+        cache.bump()
+
+    if inserted < count:
+        current_app.logger.info(f"Skipped {count - inserted} duplicate packets")
+
+    if stats.skipped_bytes:
+        current_app.logger.warning(
+            f"Skipped {stats.skipped_bytes} bytes ({stats.skipped_frames} frames) "
+            "of damaged trace regions"
+        )
 
-    db.session.commit()
+    if classes is not None:
+        classes.update(CLASSIFIER.report(counts))
 
     return count
@@ -0,0 +1,108 @@
+"""
+Keyset pagination of the data table
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Iterator, NamedTuple
+from .store import Page, epoch_ns_storage, get_store
+
+
+class TablePage(NamedTuple):
+    """
+    Rows of a table page and the cursors of its neighbours, if there are any
+    """
+
+    rows: list[tuple]
+    columns: list[str]
+    previous: str | None
+    next: str | None
+
+
+def encode_cursor(row: tuple) -> str:
+    """
+    Cursor of the row ending with its id: the CU time and the id,
+    encoded to be passed in URLs.
+    """
+
+    cutime = row[0].isoformat() if isinstance(row[0], datetime) else row[0]
+    text = json.dumps([cutime, row[-1]], separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> tuple[datetime | int, int]:
+    """
+    CU time and id of the cursor, checked against the time storage.
+    """
+
+    try:
+        text = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        cutime, row_id = json.loads(text)
+        if not epoch_ns_storage():
+            cutime = datetime.fromisoformat(cutime)
+        if not isinstance(cutime, (datetime, int)) or not isinstance(row_id, int):
+            raise TypeError
+    except (ValueError, TypeError) as err:
+        msg = f"Invalid cursor '{value}'"
+        raise ValueError(msg) from err
+
+    return cutime, row_id
+
+
+def table_page(
+    tlm_set: str,
+    channel_id: int,
+    route_time: int,
+    cursor: tuple[datetime | int, int] | None,
+    backward: bool,
+    limit: int,
+) -> TablePage:
+    """
+    Query the page of rows following the cursor, or preceding it going
+    backward. One more row is queried to tell if there is a page beyond.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    rows, columns = get_store().query_page(
+        tlm_set, channel_id, route_time, Page(cursor, backward, limit + 1)
+    )
+    beyond = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    first = encode_cursor(rows[0]) if rows else None
+    last = encode_cursor(rows[-1]) if rows else None
+    if backward:
+        previous, following = (first if beyond else None), last
+    else:
+        previous, following = (first if cursor else None), (last if beyond else None)
+
+    return TablePage([x[:-1] for x in rows], columns, previous, following)
+
+
+def table_rows(
+    tlm_set: str, channel_id: int, route_time: int, limit: int
+) -> Iterator[tuple]:
+    """
+    Every row of the route, queried a page at a time while they are
+    rendered, so that only a page is held in memory.
+    """
+
+    store = get_store()
+    cursor = None
+    while True:
+        rows, _ = store.query_page(
+            tlm_set, channel_id, route_time, Page(cursor, False, limit)
+        )
+        for row in rows:
+            yield row[:-1]
+
+        if len(rows) < limit:
+            return
+        cursor = rows[-1][0], rows[-1][-1]
@@ -0,0 +1,155 @@
+"""
+Multi-process decoding of large traces
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Generator, Iterator
+from .ip import PACKET_SIZE
+from .channel import Classifier
+from .framing import FrameStats, frame_runs
+from .layout import decode_rows
+from .trace import map_trace
+
+
+def pool_context() -> multiprocessing.context.BaseContext:
+    """
+    Start worker processes from a fresh server process rather than by
+    forking the app, whose other threads may hold locks at the time.
+    """
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Workers fork from the server with the app modules imported once
+        context.set_forkserver_preload([__name__])
+        return context
+
+    return multiprocessing.get_context("spawn")
+
+
+def split_trace(size: int, chunk: int) -> list[tuple[int, int]]:
+    """
+    Split the trace into ranges of whole packets, 'chunk' packets each.
+    """
+
+    step = chunk * PACKET_SIZE
+
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def capture(
+    decoder: Generator[tuple, None, datetime | int | None],
+    result: list[datetime | int | None],
+) -> Iterator[tuple]:
+    """
+    Give the rows of the decoder and keep its return value.
+    """
+
+    result.append((yield from decoder))
+
+
+def decode_range(
+    path: str,
+    start: int,
+    stop: int,
+    classifier: Classifier,
+    adjustments: dict[int, tuple],
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> tuple[list[tuple], Counter, FrameStats, datetime | int | None]:
+    """
+    Decode frames starting within the trace range in a worker process.
+    The last frame may end past the range. Packets before the first
+    CU packet of the range get no route, it is the last route of the
+    preceding ranges.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    counts: Counter = Counter()
+    stats = FrameStats()
+    route: list[datetime | int | None] = []
+
+    with map_trace(path) as data, memoryview(data) as view:
+        runs = frame_runs(view, start, stop, stats)
+        decoder = decode_rows(
+            view, runs, classifier, adjustments, counts, time_storage, value_storage
+        )
+        try:
+            rows = list(capture(decoder, route))
+        finally:
+            # The frame search holds the view until it is closed
+            runs.close()
+
+    return rows, counts, stats, route[0]
+
+
+def read_parallel(
+    path: str,
+    workers: int,
+    chunk: int,
+    classifier: Classifier,
+    adjustments: dict[int, tuple],
+    counts: Counter,
+    stats: FrameStats,
+    time_storage: str = "datetime",
+    value_storage: str = "calibrated",
+) -> Iterator[tuple]:
+    """
+    Decode the trace in a pool of worker processes and give the rows
+    in the trace order. At most two ranges per worker are in flight,
+    so memory use does not depend on the trace size.
+    """
+
+    # pylint: disable=too-many-arguments
+
+    size = os.path.getsize(path)
+    pending: deque[Future] = deque()
+    ft_t_on = None
+
+    def collect(future: Future) -> list[tuple]:
+        nonlocal ft_t_on
+
+        rows, range_counts, range_stats, last_route = future.result()
+        counts.update(range_counts)
+        stats.merge(range_stats)
+
+        # Rows before the first CU packet of the range take the route
+        # of the preceding ranges
+        for num, row in enumerate(rows):
+            if row[2] is not None:
+                break
+            rows[num] = row[:2] + (ft_t_on,) + row[3:]
+
+        if last_route is not None:
+            ft_t_on = last_route
+
+        return rows
+
+    with ProcessPoolExecutor(workers, mp_context=pool_context()) as pool:
+        for start, stop in split_trace(size, chunk):
+            if len(pending) >= 2 * workers:
+                yield from collect(pending.popleft())
+
+            pending.append(
+                pool.submit(
+                    decode_range,
+                    path,
+                    start,
+                    stop,
+                    classifier,
+                    adjustments,
+                    time_storage,
+                    value_storage,
+                )
+            )
+
+        while pending:
+            yield from collect(pending.popleft())
+
+    stats.finish(size)
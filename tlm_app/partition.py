@@ -0,0 +1,268 @@
+"""
+Telemetry partitioned into one SQLite file per route
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Sequence
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex, CreateTable
+from .cache import get_cache
+from .columnar import route_seconds
+from .database import apply_pragmas, db
+from .ltu_db import TABLE, SqliteStore, get_db, insert_into_table
+from .models import Telemetry, rollup
+from .store import Page, route_entry, set_columns
+from .timestamp import SECOND_NS
+
+# pylint: disable=no-member
+
+# Partition of the packets before the first CU packet, which have no route
+UNROUTED = "unrouted"
+SUFFIX = ".sqlite"
+
+
+def partition_path(folder: str, key: int | str) -> str:
+    """
+    File of the partition given by its route time in seconds.
+    """
+
+    return os.path.join(folder, f"{key}{SUFFIX}")
+
+
+def partition_schema() -> list[str]:
+    """
+    Statements creating the telemetry table and its indexes in a partition.
+    """
+
+    dialect = sqlite.dialect()
+    table = Telemetry.__table__
+
+    statements = [CreateTable(table, if_not_exists=True)]
+    statements += [CreateIndex(x, if_not_exists=True) for x in table.indexes]
+
+    return [str(x.compile(dialect=dialect)) for x in statements]
+
+
+def remove_partition(path: str) -> None:
+    """
+    Unlink the partition file with its WAL files.
+    """
+
+    for name in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def swap_folder(new: str, folder: str) -> None:
+    """
+    Move the new folder in place of the folder. The old folder is renamed
+    aside first and removed only once the new one is in place, so that
+    a crash between the renames leaves it to be restored.
+    """
+
+    old = f"{folder}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(folder):
+        os.replace(folder, old)
+    os.replace(new, folder)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def restore_folder(folder: str) -> None:
+    """
+    Put back the old folder if a swap stopped before the new one was moved in.
+    """
+
+    old = f"{folder}.old"
+    if not os.path.exists(folder) and os.path.exists(old):
+        os.replace(old, folder)
+
+
+@contextmanager
+def route_connection(
+    conn: Connection, ft_t_on: datetime | int
+) -> Iterator[Connection]:
+    """
+    Connection reading the telemetry of the route: the given one,
+    unless the telemetry is partitioned by routes.
+    """
+
+    if current_app.config["TLM_STORE"] != "partitioned":
+        yield conn
+        return
+
+    path = partition_path(
+        current_app.config["TLM_PARTITION_FOLDER"], route_seconds(ft_t_on)
+    )
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with engine.connect() as partition:
+            yield partition
+    finally:
+        engine.dispose()
+
+
+class PartitionedStore(SqliteStore):
+    """
+    Telemetry table of every route in its own file, attached to the app
+    context connection when read. Ingesting a route locks its file only,
+    dropping a route unlinks its file.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.folder = current_app.config["TLM_PARTITION_FOLDER"]
+        self.write_folder = self.folder
+        restore_folder(self.folder)
+        self.partitions: dict[int | str, sqlite3.Connection] = {}
+
+    def partition(self, key: int | str) -> sqlite3.Connection:
+        """
+        Connect to the partition being written, creating it if needed.
+        """
+
+        if key not in self.partitions:
+            os.makedirs(self.write_folder, exist_ok=True)
+            conn = sqlite3.connect(partition_path(self.write_folder, key))
+            apply_pragmas(conn, current_app.config["TLM_SQLITE_PRAGMAS"])
+            apply_pragmas(conn, current_app.config["TLM_SQLITE_BULK_PRAGMAS"])
+            for statement in partition_schema():
+                conn.execute(statement)
+            self.partitions[key] = conn
+
+        return self.partitions[key]
+
+    def close_partitions(self) -> None:
+        """
+        Close the connections of the partitions written,
+        dropping the rows not committed.
+        """
+
+        for conn in self.partitions.values():
+            conn.close()
+        self.partitions.clear()
+
+    @contextmanager
+    def ingest(self, replace: bool) -> Iterator[None]:
+        """
+        Write the routes over a connection per partition. In the "replace"
+        mode partitions are written into a new folder, which replaces
+        the stored one once the ingest is done.
+        """
+
+        if replace:
+            self.write_folder = f"{self.folder}.new"
+            shutil.rmtree(self.write_folder, ignore_errors=True)
+            os.makedirs(self.write_folder)
+
+        try:
+            yield
+        except BaseException:
+            self.close_partitions()
+            if replace:
+                shutil.rmtree(self.write_folder, ignore_errors=True)
+            raise
+        finally:
+            self.close_partitions()
+            write_folder, self.write_folder = self.write_folder, self.folder
+
+        if replace:
+            swap_folder(write_folder, self.folder)
+
+    def write_batch(self, rows: Sequence[tuple]) -> int:
+        """
+        Insert the rows of every route into its partition.
+        """
+
+        groups: dict[int | str, list[tuple]] = {}
+        for row in rows:
+            key: int | str = UNROUTED if row[2] is None else route_seconds(row[2])
+            groups.setdefault(key, []).append(row)
+
+        inserted = 0
+        for key, group in groups.items():
+            conn = self.partition(key)
+            inserted += insert_into_table(conn, self.columns, self.format_rows(group))
+            conn.commit()
+
+        return inserted
+
+    def query_partition(
+        self, tlm_set: str, channel_id: int, route_time: int, page: Page | None
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Attach the partition of the route and query it.
+        """
+
+        path = partition_path(self.folder, int(route_time))
+        if not os.path.exists(path):
+            return [], set_columns(tlm_set)
+
+        conn = get_db()
+        schema = f"route_{int(route_time)}"
+        conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+        try:
+            return self.query_table(
+                conn, f"{schema}.{TABLE}", tlm_set, channel_id, route_time, page
+            )
+        finally:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+    def query_series(
+        self, tlm_set: str, channel_id: int, route_time: int
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the set columns from the partition of the route.
+        """
+
+        return self.query_partition(tlm_set, channel_id, route_time, None)
+
+    def query_page(
+        self, tlm_set: str, channel_id: int, route_time: int, page: Page
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the keyset page from the partition of the route.
+        """
+
+        return self.query_partition(tlm_set, channel_id, route_time, page)
+
+    def list_routes(self) -> list[tuple[int, datetime]]:
+        """
+        List the partition files.
+        """
+
+        if not os.path.isdir(self.folder):
+            return []
+
+        files = [x for x in os.listdir(self.folder) if x.endswith(SUFFIX)]
+        keys = [x[: -len(SUFFIX)] for x in files]
+        seconds = sorted(int(x) for x in keys if x.isdigit())
+        if self.epoch_ns:
+            return [route_entry(x * SECOND_NS) for x in seconds]
+
+        return [(x, datetime.fromtimestamp(x)) for x in seconds]
+
+    def drop_route(self, route_time: int) -> None:
+        """
+        Unlink the partition of the route and delete its rollups.
+        Cached results are dropped.
+        """
+
+        # pylint: disable=import-outside-toplevel,cyclic-import
+
+        from .rollup import route_filter
+
+        remove_partition(partition_path(self.folder, int(route_time)))
+
+        db.session.execute(rollup.delete().where(route_filter(route_time)))
+        db.session.commit()
+        get_cache().bump()
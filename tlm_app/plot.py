@@ -3,15 +3,26 @@ Plot settings
 """
 
 from typing import Sequence
-from datetime import datetime
+import numpy as np
 import matplotlib  # type: ignore
 import matplotlib.dates as md  # type: ignore
-import matplotlib.pyplot as plt  # type: ignore
-from .database import db
-from .models import Channel, Telemetry
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # type: ignore
+from matplotlib.figure import Figure  # type: ignore
+from flask import current_app
+from .cache import cached
+from .calibration import calibrate_series, counts_storage
+from .channel import CLASSIFIER
 from .subsets import sets
+from .columnar import read_series
+from .store import get_store
+from .rollup import choose_level, collect_rollup
+from .timestamp import LOCAL_OFFSET_NS, epoch_ns_to_local
 
-matplotlib.use("Agg")
+PLOT_DPI = 150
+# Plot width in pixels
+PLOT_WIDTH = int(matplotlib.rcParams["figure.figsize"][0] * PLOT_DPI)
+# Points of every value kept for plotting, two per pixel
+PLOT_POINTS = 2 * PLOT_WIDTH
 
 
 # pylint: disable=no-member
@@ -22,39 +33,128 @@ def view_routes() -> list[tuple]:
     Get list of routes to pass in 'base.html' template
     """
 
-    stmt = db.select([db.distinct(Telemetry.ft_t_on)])
-    routes = db.session.execute(stmt)
+    return get_store().list_routes()
 
-    return [(int(x[0].timestamp()), x[0]) for x in routes]
 
+def channel_id_by_name(channel: str) -> int:
+    """
+    Look the channel id up by its name among the channels loaded by
+    the classifier, raising ValueError if it is unknown.
+    """
+
+    if not CLASSIFIER.classes:
+        CLASSIFIER.load()
+
+    if channel not in CLASSIFIER.ids:
+        msg = f"No such channel '{channel}'"
+        raise ValueError(msg)
+
+    return CLASSIFIER.ids[channel]
+
+
+def columnar_columns(
+    tlm_set: str, channel_id: int, route_time: int
+) -> list[np.ndarray] | None:
+    """
+    Map the set columns from the columnar store, if it is enabled
+    and has the route. CU times are Unix times in nanoseconds,
+    values stored as counts are calibrated at once.
+    """
+
+    if not current_app.config["TLM_COLUMNAR"]:
+        return None
+
+    folder = current_app.config["TLM_COLUMNAR_FOLDER"]
+    series = read_series(folder, route_time, channel_id, sets[tlm_set])
+    if series is not None and counts_storage():
+        series = calibrate_series(sets[tlm_set], series, channel_id)
 
-def collect_data(
-    tlm_set: str, channel: str, ft_t_on: datetime
+    return series
+
+
+def columnar_series(
+    tlm_set: str, channel_id: int, route_time: int
+) -> list[np.ndarray] | None:
+    """
+    Map the set columns from the columnar store, if it is enabled
+    and has the route. CU times are converted to local times at once.
+    """
+
+    series = columnar_columns(tlm_set, channel_id, route_time)
+    if series is not None:
+        series[0] = epoch_ns_to_local(series[0])
+
+    return series
+
+
+def query_data(
+    tlm_set: str, channel_id: int, route_time: int
 ) -> tuple[list[tuple], list[str]]:
     """
-    Collect telemetry data for the specific LTU set and channel.
+    Query the set columns of the channel route from the telemetry store.
     """
 
-    # pylint: disable=no-member
+    return get_store().query_series(tlm_set, channel_id, route_time)
 
-    stmt = db.select(Channel.id).where(Channel.name == channel)
-    channel_id = db.session.execute(stmt).fetchone()[0]
 
-    columns = [db.column(x) for x in sets[tlm_set]]
-    stmt = (
-        db.select(columns)
-        .select_from(Telemetry)
-        .where(Telemetry.channel_id == channel_id)
-        .where(Telemetry.ft_t_on == ft_t_on)
-    )
-    print(stmt)
-    result = db.session.execute(stmt)
-    return list(result), list(result.keys())
+@cached("columns")
+def collect_columns(
+    tlm_set: str, channel: str, route_time: int
+) -> tuple[np.ndarray, list[np.ndarray], list[str]]:
+    """
+    Collect CU times as Unix times in nanoseconds and the values
+    of the set as doubles, column by column.
+    """
 
+    channel_id = channel_id_by_name(channel)
+    names = sets[tlm_set]
 
-def collect_for_plot(rows: list[tuple], columns: list[str]) -> list[list]:
+    series = columnar_columns(tlm_set, channel_id, route_time)
+    if series is not None:
+        return np.asarray(series[0]), [np.asarray(x) for x in series[1:]], names
+
+    rows, columns = query_data(tlm_set, channel_id, route_time)
+    data = list(zip(*rows)) or [() for _ in columns]
+    if columns[0] == "cutime_ns":
+        times = np.array(data[0], dtype=np.int64)
+    else:
+        # Datetimes are stored as local times
+        local = np.array(data[0], dtype="datetime64[ns]").astype(np.int64)
+        times = local - LOCAL_OFFSET_NS
+
+    return times, [np.array(x, dtype=np.float64) for x in data[1:]], names
+
+
+@cached("series")
+def collect_series(
+    tlm_set: str, channel: str, route_time: int
+) -> tuple[list, list[str], list[tuple] | None]:
+    """
+    Collect telemetry data for plotting, column by column.
+    Long routes are taken from the coarsest rollup level still giving
+    a bucket per pixel, with the min/max envelopes of the values.
+    Columns of the columnar store are not copied.
+    """
+
+    channel_id = channel_id_by_name(channel)
+    names = sets[tlm_set]
+
+    level = choose_level(channel_id, route_time, PLOT_WIDTH)
+    if level is not None:
+        series, envelopes = collect_rollup(names[1:], channel_id, route_time, level)
+        return series, list(names), envelopes
+
+    mapped = columnar_series(tlm_set, channel_id, route_time)
+    if mapped is not None:
+        return mapped, list(names), None
+
+    rows, columns = query_data(tlm_set, channel_id, route_time)
+    return collect_for_plot(rows, columns), columns, None
+
+
+def collect_for_plot(rows: list[tuple], columns: list[str]) -> list:
     """
-    Gather data into multiple lists.
+    Gather data into multiple lists, integer CU times into an array.
     """
 
     params_list: list[list] = []
@@ -64,36 +164,61 @@ def collect_for_plot(rows: list[tuple], columns: list[str]) -> list[list]:
     for row in rows:
         for index, elem in enumerate(row):
             params_list[index].append(elem)
+
+    # Integer times are converted all at once
+    if columns and columns[0] == "cutime_ns":
+        times = epoch_ns_to_local(np.array(params_list[0], dtype=np.int64))
+        return [times, *params_list[1:]]
+
     return params_list
 
 
+def render_options() -> tuple:
+    """
+    Options the rendered plot depends on besides its data.
+    """
+
+    figsize = tuple(matplotlib.rcParams["figure.figsize"])
+    return PLOT_DPI, figsize, matplotlib.__version__
+
+
 def plot_telemetry(
-    filename: str, params_list: list[list], columns: Sequence[str], title: str
+    filename: str,
+    params_list: list[list],
+    columns: Sequence[str],
+    title: str,
+    envelopes: list[tuple] | None = None,
 ) -> None:
     """
-    Create a plot.
+    Create a plot, shading the min/max envelopes of the values if given.
+    The figure is not registered with pyplot, so concurrent renders do not
+    share any state and the figure is freed with its last reference.
     """
 
-    fig = plt.figure(dpi=150)
-    plt.tick_params(axis="both", which="major", labelsize=10)
-    plt.minorticks_on()
-    plt.grid(which="minor", linewidth=0.5, linestyle="--")
-    plt.grid(which="major", color="grey", linewidth=1)
+    fig = Figure(dpi=PLOT_DPI)
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot()
+    axes.tick_params(axis="both", which="major", labelsize=10)
+    axes.minorticks_on()
+    axes.grid(which="minor", linewidth=0.5, linestyle="--")
+    axes.grid(which="major", color="grey", linewidth=1)
     y_name, title_name = get_labels(columns)
-    plt.ylabel(y_name, fontsize=16)
-    plt.title(f"{title} {title_name}", fontsize=16)
-    plt.xlabel("Time", fontsize=16)
-    axes = plt.gca()
+    axes.set_ylabel(y_name, fontsize=16)
+    axes.set_title(f"{title} {title_name}", fontsize=16)
+    axes.set_xlabel("Time", fontsize=16)
     fig.autofmt_xdate()
     xfmt = md.DateFormatter("%Y-%m-%d")
     axes.xaxis.set_major_formatter(xfmt)
+    times = md.date2num(params_list[0])
     for param in params_list[1:]:
-        plt.plot(md.date2num(params_list[0]), param)
+        axes.plot(times, param)
+    for (low, high), line in zip(envelopes or (), axes.get_lines()):
+        axes.fill_between(times, low, high, color=line.get_color(), alpha=0.3)
 
     # Shows colored parameter names labels on a plot
-    plt.legend(columns[1:], loc="best", prop={"size": 10})
+    axes.legend(columns[1:], loc="best", prop={"size": 10})
 
-    plt.savefig(filename)
+    fig.savefig(filename)
 
 
 def get_labels(plot_list: Sequence[str]) -> tuple[str, str]:
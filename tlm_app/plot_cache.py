@@ -0,0 +1,81 @@
+"""
+Content-addressed cache of plot images on disk
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from typing import Callable, Hashable
+
+SUFFIX = ".png"
+# Images never change under their names
+PLOT_MAX_AGE = 365 * 24 * 3600
+
+
+def plot_filename(*parts: Hashable) -> str:
+    """
+    Image name hashed from everything the plot depends on: the request,
+    the data generation and the render options.
+    """
+
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32] + SUFFIX
+
+
+def evict_plots(folder: str, max_bytes: int, keep: str) -> None:
+    """
+    Remove the least recently used images until the folder fits the limit.
+    """
+
+    entries = []
+    for entry in os.scandir(folder):
+        # Images being rendered are hidden
+        if entry.name.startswith(".") or not entry.name.endswith(SUFFIX):
+            continue
+        if entry.is_file() and entry.path != keep:
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(x[1] for x in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def fetch_plot(
+    folder: str, filename: str, render: Callable[[str], None], max_bytes: int
+) -> bool:
+    """
+    Render the image into the folder unless it is there already.
+    Images are renamed into place once complete, so that concurrent
+    requests never see a partial one. Return True if it was cached.
+    """
+
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        try:
+            # Modification times give the least recently used order
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            pass
+
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(SUFFIX, ".", folder)
+    os.close(fd)
+    try:
+        render(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    evict_plots(folder, max_bytes, path)
+
+    return False
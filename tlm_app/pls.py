@@ -38,7 +38,7 @@ class PlsTelemetry:
     hvf2: float
 
     @staticmethod
-    def load_from_packet(packet: bytes) -> PlsTelemetry:
+    def load_from_packet(packet: bytes | memoryview) -> PlsTelemetry:
         """
         Get PLS voltages, currents and temperatures
         """
@@ -0,0 +1,60 @@
+"""
+Plot rendering in the request thread or in a pool of worker processes
+"""
+
+from __future__ import annotations
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from .parallel import pool_context
+from .plot import plot_telemetry
+
+
+class Renderer:
+    """
+    Plots rendered by a pool of worker processes, if there are workers.
+    At most 'queue' renders wait for a free worker, further requests
+    are held until one of them starts, so the memory held by renders
+    does not grow with the traffic.
+    """
+
+    def __init__(self, workers: int, queue: int):
+        self.workers = workers
+        self.slots = BoundedSemaphore(workers + queue) if workers > 0 else None
+        self.pool: ProcessPoolExecutor | None = None
+        self.lock = Lock()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """
+        Start the worker processes on the first render, stopping them
+        when the app exits.
+        """
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=pool_context())
+                atexit.register(self.shutdown)
+            return self.pool
+
+    def render(self, filename: str, *args) -> None:
+        """
+        Render the plot into the file with 'plot_telemetry' arguments.
+        """
+
+        if self.slots is None:
+            plot_telemetry(filename, *args)
+            return
+
+        with self.slots:
+            self.get_pool().submit(plot_telemetry, filename, *args).result()
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+        """
+
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
@@ -0,0 +1,291 @@
+"""
+Multi-resolution rollups of telemetry series
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Iterable
+import numpy as np
+from flask import current_app
+from .calibration import FIELDS, calibrate, channel_adjustments, counts_storage
+from .database import db
+from .models import ROLLUP_STATS, ROLLUP_VALUES, Telemetry, rollup
+from .partition import route_connection
+from .timestamp import SECOND_NS, epoch_ns_to_local
+
+# Rows of a channel route read and aggregated at once
+ROLLUP_CHUNK = 65536
+
+# pylint: disable=no-member
+
+
+def route_columns(epoch_ns: bool) -> tuple:
+    """
+    Route columns of the telemetry and rollup tables for the time storage.
+    """
+
+    if epoch_ns:
+        return Telemetry.ft_t_on_ns, rollup.c.ft_t_on_ns
+
+    return Telemetry.ft_t_on, rollup.c.ft_t_on
+
+
+def seconds_expression(epoch_ns: bool):
+    """
+    SQL expression of the CU time in whole seconds.
+    Datetimes are local times, so are their buckets.
+    """
+
+    if epoch_ns:
+        return Telemetry.cutime_ns / SECOND_NS
+
+    # Julian days are not precise enough at bucket edges
+    return db.cast(db.func.strftime("%s", Telemetry.cutime), db.Integer)
+
+
+def aggregate(seconds: np.ndarray, values: np.ndarray, level: int) -> tuple:
+    """
+    Buckets of the level with the count, min, max and sum of the values
+    in each, the values being in the CU time order.
+    """
+
+    buckets = seconds // level
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+
+    return (
+        buckets[starts],
+        counts,
+        np.minimum.reduceat(values, starts),
+        np.maximum.reduceat(values, starts),
+        np.add.reduceat(values, starts),
+    )
+
+
+def merge_first(previous: tuple, partial: tuple) -> tuple:
+    """
+    Merge the single bucket aggregated from the previous rows
+    into the first bucket of the partial aggregates.
+    """
+
+    buckets, counts, mins, maxs, sums = partial
+    counts[0] += previous[1][0]
+    mins[0] = np.minimum(mins[0], previous[2][0])
+    maxs[0] = np.maximum(maxs[0], previous[3][0])
+    sums[0] += previous[4][0]
+
+    return buckets, counts, mins, maxs, sums
+
+
+class RollupWriter:
+    """
+    Rollups of a channel route aggregated from its rows chunk by chunk.
+    The last bucket of every level is held back until the next chunk,
+    which may continue it, so that only a chunk is in memory at once.
+    """
+
+    def __init__(self, conn, insert_script: str, key: tuple, levels):
+        self.conn = conn
+        self.insert_script = insert_script
+        self.key = key
+        self.pending: dict[int, tuple | None] = dict.fromkeys(levels)
+
+    def add(self, data: np.ndarray) -> None:
+        """
+        Aggregate the rows of seconds and values following the rows added.
+        """
+
+        seconds = data[:, 0].astype(np.int64)
+
+        for level, previous in self.pending.items():
+            partial = aggregate(seconds, data[:, 1:], level)
+            if previous is not None:
+                if previous[0][0] == partial[0][0]:
+                    partial = merge_first(previous, partial)
+                else:
+                    self.insert(level, previous)
+            self.insert(level, tuple(x[:-1] for x in partial))
+            self.pending[level] = tuple(x[-1:].copy() for x in partial)
+
+    def finish(self) -> None:
+        """
+        Insert the last buckets.
+        """
+
+        for level, previous in self.pending.items():
+            if previous is not None:
+                self.insert(level, previous)
+
+    def insert(self, level: int, aggregates: tuple) -> None:
+        """
+        Insert the buckets of the level with the means of their values.
+        """
+
+        buckets, counts, mins, maxs, sums = aggregates
+        if not buckets.size:
+            return
+
+        # Interleaved as min, max and mean of every value
+        stats = (mins, maxs, sums / counts[:, None])
+        values = np.stack(stats, axis=2).reshape(len(buckets), -1)
+        self.conn.exec_driver_sql(
+            self.insert_script,
+            [
+                (level, *self.key, bucket, count, *row)
+                for bucket, count, row in zip(
+                    buckets.tolist(), counts.tolist(), values.tolist()
+                )
+            ],
+        )
+
+
+def update_rollups(routes: Iterable[datetime | int], replace: bool) -> None:
+    """
+    Recompute the rollups of the ingested routes from the stored telemetry,
+    all of them in the "replace" ingest mode. Every channel route is read
+    once in the CU time order, from its partition if the telemetry is
+    partitioned, in chunks of ROLLUP_CHUNK rows aggregated at every level.
+    Values stored as counts are summarised as counts.
+    """
+
+    # pylint: disable=too-many-locals
+
+    levels = current_app.config["TLM_ROLLUP_LEVELS"]
+    epoch_ns = current_app.config["TLM_TIME_STORAGE"] == "epoch_ns"
+    route, rollup_route = route_columns(epoch_ns)
+    cutime = Telemetry.cutime_ns if epoch_ns else Telemetry.cutime
+    routes = list(routes)
+
+    # Plain tuples through the driver, binding hundreds of thousands
+    # of rows with a hundred values each is slow in SQLAlchemy
+    columns = ["level", "channel_id", rollup_route.name, "bucket", "count"] + [
+        f"{name}_{stat}" for name in ROLLUP_VALUES for stat in ROLLUP_STATS
+    ]
+    insert_script = (
+        f"INSERT INTO {rollup.name} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
+
+    with db.engine.begin() as conn:
+        if replace:
+            conn.execute(rollup.delete())
+        else:
+            conn.execute(rollup.delete().where(rollup_route.in_(routes)))
+
+        if not levels or not routes:
+            return
+
+        # Datetime routes formatted as SQLAlchemy stores them
+        route_type = rollup_route.type.dialect_impl(conn.dialect)
+        bind_route = route_type.bind_processor(conn.dialect)
+
+        for ft_t_on in routes:
+            with route_connection(conn, ft_t_on) as source:
+                channels = source.execute(
+                    db.select([Telemetry.channel_id]).distinct().where(route == ft_t_on)
+                ).scalars()
+                for channel_id in list(channels):
+                    stmt = (
+                        db.select(
+                            [seconds_expression(epoch_ns)]
+                            + [getattr(Telemetry, x) for x in ROLLUP_VALUES]
+                        )
+                        .where(Telemetry.channel_id == channel_id)
+                        .where(route == ft_t_on)
+                        .order_by(cutime)
+                    )
+                    key = (channel_id, bind_route(ft_t_on) if bind_route else ft_t_on)
+                    writer = RollupWriter(conn, insert_script, key, levels)
+                    result = source.execute(
+                        stmt.execution_options(yield_per=ROLLUP_CHUNK)
+                    )
+                    for rows in result.partitions():
+                        # Tuples, numpy probes SQLAlchemy rows for attributes
+                        writer.add(np.array([tuple(x) for x in rows], np.float64))
+                    writer.finish()
+
+
+def choose_level(channel_id: int, route_time: int, width: int) -> int | None:
+    """
+    Choose the coarsest level still giving a bucket per pixel of the plot
+    width for the channel route. Return None if raw data are needed.
+    """
+
+    levels = sorted(current_app.config["TLM_ROLLUP_LEVELS"])
+    if not levels:
+        return None
+
+    bucket_range = (
+        db.select([db.func.min(rollup.c.bucket), db.func.max(rollup.c.bucket)])
+        .where(rollup.c.level == levels[0])
+        .where(rollup.c.channel_id == channel_id)
+        .where(route_filter(route_time))
+    )
+    first, last = db.session.execute(bucket_range).one()
+    if first is None:
+        return None
+
+    span = (last - first + 1) * levels[0]
+    chosen = [x for x in levels if span // x >= width]
+
+    return chosen[-1] if chosen else None
+
+
+def route_filter(route_time: int):
+    """
+    Rollup route condition for the route given by its Unix time in seconds.
+    """
+
+    if current_app.config["TLM_TIME_STORAGE"] == "epoch_ns":
+        return rollup.c.ft_t_on_ns == route_time * SECOND_NS
+
+    return rollup.c.ft_t_on == datetime.fromtimestamp(route_time)
+
+
+def collect_rollup(
+    names: list[str], channel_id: int, route_time: int, level: int
+) -> tuple[list[np.ndarray], list[tuple[np.ndarray, np.ndarray]]]:
+    """
+    Collect bucket times, means and min/max envelopes of the named values.
+    Rollups of values stored as counts are calibrated at once.
+    """
+
+    # pylint: disable=too-many-locals
+
+    columns = [rollup.c.bucket]
+    for name in names:
+        columns += [rollup.c[f"{name}_{stat}"] for stat in ROLLUP_STATS]
+
+    stmt = (
+        db.select(columns)
+        .where(rollup.c.level == level)
+        .where(rollup.c.channel_id == channel_id)
+        .where(route_filter(route_time))
+        .order_by(rollup.c.bucket)
+    )
+    rows = [tuple(x) for x in db.session.execute(stmt)]
+    data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+
+    seconds = data[:, 0].astype(np.int64) * level
+    if current_app.config["TLM_TIME_STORAGE"] == "epoch_ns":
+        times = epoch_ns_to_local(seconds * SECOND_NS)
+    else:
+        times = seconds.astype("datetime64[s]")
+
+    adjustments = channel_adjustments(channel_id) if counts_storage() else None
+
+    series = [times]
+    envelopes = []
+    for num, name in enumerate(names):
+        low, high, mean = data[:, 1 + 3 * num: 4 + 3 * num].T
+        if adjustments is not None:
+            low, high, mean = (
+                calibrate(FIELDS[name], x, adjustments) for x in (low, high, mean)
+            )
+            # A negative scale swaps the bounds
+            low, high = np.minimum(low, high), np.maximum(low, high)
+        series.append(mean)
+        envelopes.append((low, high))
+
+    return series, envelopes
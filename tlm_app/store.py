@@ -0,0 +1,284 @@
+"""
+Telemetry storage backends
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, ContextManager, Iterator, NamedTuple, Protocol, Sequence
+from flask import current_app
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Select
+from .calibration import FIELDS, calibrate, channel_adjustments, counts_storage
+from .database import db, bulk_profile
+from .models import Telemetry
+from .layout import row_columns
+from .subsets import sets
+from .timestamp import SECOND_NS, BEIJING_TIME
+
+# pylint: disable=no-member
+
+
+class Page(NamedTuple):
+    """
+    Keyset page: the CU time and the id of the row the page follows,
+    or precedes if it goes backward, and the row count limit.
+    """
+
+    cursor: tuple[datetime | int, int] | None
+    backward: bool
+    limit: int
+
+
+class TelemetryStore(Protocol):
+    """
+    Storage of decoded telemetry rows
+    """
+
+    def ingest(self, replace: bool) -> ContextManager[None]:
+        """
+        Prepare the store for writing a trace, deleting the stored rows
+        first if asked. Rows not committed by 'write_batch' are dropped
+        if the ingest fails.
+        """
+
+    def write_batch(self, rows: Sequence[tuple]) -> int:
+        """
+        Insert and commit the rows ordered as 'row_columns', skipping
+        packets already stored. Return the number of inserted rows.
+        """
+
+    def query_series(
+        self, tlm_set: str, channel_id: int, route_time: int
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Get the set columns of the channel route in the CU time order.
+        """
+
+    def query_page(
+        self, tlm_set: str, channel_id: int, route_time: int, page: Page
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Get the set columns of up to 'limit' rows of the channel route
+        following the cursor in the CU time order, or preceding it in the
+        reverse order going backward. Rows end with their ids.
+        """
+
+    def list_routes(self) -> list[tuple[int, datetime]]:
+        """
+        Get the stored routes as their Unix time in seconds and local time.
+        """
+
+
+def epoch_ns_storage() -> bool:
+    """
+    Check if CU times and routes are stored as integer nanoseconds.
+    """
+
+    return current_app.config["TLM_TIME_STORAGE"] == "epoch_ns"
+
+
+def set_columns(tlm_set: str) -> list[str]:
+    """
+    Table columns of the set for the configured time storage.
+    """
+
+    if epoch_ns_storage():
+        return ["cutime_ns" if x == "cutime" else x for x in sets[tlm_set]]
+
+    return list(sets[tlm_set])
+
+
+def route_entry(ft_t_on: datetime | int) -> tuple[int, datetime]:
+    """
+    Route as its Unix time in seconds and local time.
+    """
+
+    if isinstance(ft_t_on, int):
+        seconds = ft_t_on // SECOND_NS
+        local = datetime.fromtimestamp(seconds, BEIJING_TIME).replace(tzinfo=None)
+        return seconds, local
+
+    return int(ft_t_on.timestamp()), ft_t_on
+
+
+def routes_statement() -> Select:
+    """
+    Select distinct routes of the configured time storage.
+    Packets before the first CU packet have no route.
+    """
+
+    if epoch_ns_storage():
+        route = Telemetry.ft_t_on_ns
+    else:
+        route = Telemetry.ft_t_on
+
+    return db.select([db.distinct(route)]).where(route.isnot(None))
+
+
+def data_statement(tlm_set: str, channel_id: int, route_time: int) -> Select:
+    """
+    Select the set columns of the channel route in the CU time order.
+    """
+
+    return columns_statement(set_columns(tlm_set), channel_id, route_time)
+
+
+def columns_statement(
+    names: Sequence[str], channel_id: int, route_time: int
+) -> Select:
+    """
+    Select the columns of the channel route in the CU time order.
+    Values stored as counts are calibrated by the query.
+    """
+
+    if epoch_ns_storage():
+        route = Telemetry.ft_t_on_ns == route_time * SECOND_NS
+        cutime = Telemetry.cutime_ns
+    else:
+        route = Telemetry.ft_t_on == datetime.fromtimestamp(route_time)
+        cutime = Telemetry.cutime
+
+    # Typed columns, so that CU times are read as datetimes
+    columns = [getattr(Telemetry, x) for x in names]
+    if counts_storage():
+        adjustments = channel_adjustments(channel_id)
+        columns = [
+            calibrate(FIELDS[x.name], x, adjustments).label(x.name)
+            if x.name in FIELDS
+            else x
+            for x in columns
+        ]
+
+    return (
+        db.select(columns)
+        .where(Telemetry.channel_id == channel_id)
+        .where(route)
+        .order_by(cutime)
+    )
+
+
+def page_statement(
+    tlm_set: str, channel_id: int, route_time: int, page: Page
+) -> Select:
+    """
+    Select a keyset page of the set columns and the row ids. Rows are
+    ordered by CU time and id, which the channel route index gives.
+    """
+
+    cutime = Telemetry.cutime_ns if epoch_ns_storage() else Telemetry.cutime
+    key = db.tuple_(cutime, Telemetry.id)
+    stmt = data_statement(tlm_set, channel_id, route_time).add_columns(Telemetry.id)
+
+    if page.backward:
+        order = [cutime.desc(), Telemetry.id.desc()]
+        if page.cursor is not None:
+            stmt = stmt.where(key < page.cursor)
+    else:
+        order = [cutime, Telemetry.id]
+        if page.cursor is not None:
+            stmt = stmt.where(key > page.cursor)
+
+    return stmt.order_by(None).order_by(*order).limit(page.limit)
+
+
+class SqlAlchemyStore:
+    """
+    Telemetry table accessed with SQLAlchemy Core over the app engine
+    """
+
+    def __init__(self):
+        self.columns = row_columns(current_app.config["TLM_TIME_STORAGE"])
+        # Packets already in the database are skipped
+        self.insert = db.insert(Telemetry.__table__).prefix_with(
+            "OR IGNORE", dialect="sqlite"
+        )
+        self.conn: Connection | None = None
+
+    @contextmanager
+    def ingest(self, replace: bool) -> Iterator[None]:
+        """
+        Write over one connection with the bulk ingest profile.
+        """
+
+        with db.engine.connect() as conn, bulk_profile(conn):
+            self.conn = conn
+            conn.begin()
+            try:
+                if replace:
+                    conn.execute(db.delete(Telemetry))
+                yield
+                conn.get_transaction().commit()
+            except BaseException:
+                # SQLite cannot restore the profile inside a transaction
+                if conn.in_transaction():
+                    conn.get_transaction().rollback()
+                raise
+            finally:
+                self.conn = None
+
+    def write_batch(self, rows: Sequence[tuple]) -> int:
+        """
+        Insert the rows with one executemany call.
+        """
+
+        assert self.conn is not None, "Not ingesting"
+
+        params = [dict(zip(self.columns, x)) for x in rows]
+        inserted = self.conn.execute(self.insert, params).rowcount
+        self.conn.get_transaction().commit()
+        self.conn.begin()
+
+        return inserted
+
+    def query_series(
+        self, tlm_set: str, channel_id: int, route_time: int
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the set columns with the app session.
+        """
+
+        result = db.session.execute(data_statement(tlm_set, channel_id, route_time))
+        return list(result), list(result.keys())
+
+    def query_page(
+        self, tlm_set: str, channel_id: int, route_time: int, page: Page
+    ) -> tuple[list[tuple], list[str]]:
+        """
+        Query the keyset page with the app session.
+        """
+
+        stmt = page_statement(tlm_set, channel_id, route_time, page)
+        rows = [tuple(x) for x in db.session.execute(stmt)]
+        return rows, set_columns(tlm_set)
+
+    def list_routes(self) -> list[tuple[int, datetime]]:
+        """
+        Query the routes with the app session.
+        """
+
+        return [route_entry(x) for (x,) in db.session.execute(routes_statement())]
+
+
+def get_store() -> TelemetryStore:
+    """
+    Create the configured telemetry store.
+    """
+
+    # pylint: disable=import-outside-toplevel,cyclic-import
+
+    from .ltu_db import SqliteStore
+    from .partition import PartitionedStore
+
+    stores: dict[str, Callable[[], TelemetryStore]] = {
+        "sqlalchemy": SqlAlchemyStore,
+        "sqlite": SqliteStore,
+        "partitioned": PartitionedStore,
+    }
+    name = current_app.config["TLM_STORE"]
+    if name not in stores:
+        msg = f"Unknown telemetry store '{name}'"
+        raise ValueError(msg)
+
+    return stores[name]()
@@ -3,6 +3,7 @@ Timestamp utils
 """
 
 from datetime import datetime, timezone, timedelta
+import numpy as np
 
 TIME_UNIT = 8e-9
 
@@ -25,3 +26,47 @@ def ton_to_unixtime(t_on: int) -> datetime:
     """
 
     return SCS_EPOCH + timedelta(seconds=t_on)
+
+
+# CU ticks and times in integer nanoseconds
+TICK_NS = 8
+SECOND_NS = 10**9
+SCS_EPOCH_NS = int(SCS_EPOCH.timestamp()) * SECOND_NS
+LOCAL_OFFSET_NS = int(BEIJING_TIME.utcoffset(None).total_seconds()) * SECOND_NS
+
+
+def timestamp_to_epoch_ns(tstamp: int) -> int:
+    """
+    Convert CU timestamps to Unix time in nanoseconds.
+    """
+
+    return SCS_EPOCH_NS + TICK_NS * tstamp
+
+
+def ton_to_epoch_ns(t_on: int) -> int:
+    """
+    Convert mission scenario system time to Unix time in nanoseconds.
+    """
+
+    return SCS_EPOCH_NS + SECOND_NS * t_on
+
+
+def timestamps_to_datetime64(ticks: np.ndarray) -> np.ndarray:
+    """
+    Convert an array of CU timestamps to UTC times at once.
+    """
+
+    epoch_ns = SCS_EPOCH_NS + TICK_NS * ticks.astype(np.int64)
+
+    return epoch_ns.astype("datetime64[ns]")
+
+
+def epoch_ns_to_local(epoch_ns: np.ndarray) -> np.ndarray:
+    """
+    Convert an array of Unix times in nanoseconds to the satellite
+    control system local times, the way they are shown.
+    """
+
+    return (np.asarray(epoch_ns, dtype=np.int64) + LOCAL_OFFSET_NS).astype(
+        "datetime64[ns]"
+    )
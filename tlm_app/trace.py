@@ -0,0 +1,57 @@
+"""
+Trace files storage and memory mapping
+"""
+
+import os
+from contextlib import contextmanager
+from mmap import mmap, ACCESS_READ
+from typing import Iterator
+from uuid import uuid4
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from .ip import PACKET_SIZE
+from .framing import FrameStats, iter_frames
+
+
+def save_upload(file: FileStorage) -> str:
+    """
+    Save the uploaded trace to the upload folder and return its path.
+    The name is made unique, so that concurrent uploads do not clash.
+    """
+
+    folder = current_app.config["UPLOAD_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    filename = secure_filename(file.filename or "trace.tld")
+    path = os.path.join(folder, f"{uuid4().hex}_{filename}")
+    file.save(path)
+
+    return path
+
+
+@contextmanager
+def map_trace(path: str) -> Iterator[bytes | mmap]:
+    """
+    Map the trace file into memory, read-only.
+    An empty file cannot be mapped, so it is given as empty bytes.
+    """
+
+    with open(path, "rb") as file:
+        if not os.fstat(file.fileno()).st_size:
+            yield b""
+            return
+
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as data:
+            yield data
+
+
+def iter_packets(data: bytes | mmap, stats: FrameStats) -> Iterator[memoryview]:
+    """
+    Slice valid frames of the trace into packets without copying them.
+    """
+
+    with memoryview(data) as view:
+        for offset, count in iter_frames(view, stats):
+            for pos in range(offset, offset + count * PACKET_SIZE, PACKET_SIZE):
+                with view[pos: pos + PACKET_SIZE] as packet:
+                    yield packet
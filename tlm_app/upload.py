@@ -2,9 +2,11 @@
 Uploading LTU traces
 """
 
-from typing import BinaryIO, cast
+import os
 from flask import flash, request, render_template, current_app
 from .packet import get_telemetry
+from .trace import save_upload
+from .framing import FrameStats
 
 ALLOWED_EXTENSIONS = {"tld"}
 
@@ -37,12 +39,37 @@ def upload_file():
             current_app.logger.error(msg)
 
         elif file and allowed_file(file.filename):
-            count = get_telemetry(cast(BinaryIO, file))
+            path = save_upload(file)
+
+            if current_app.config["TLM_ASYNC_INGEST"]:
+                job = current_app.extensions["tlm_jobs"].submit(path, file.filename)
+                msg = f"The file '{file.filename}' has been queued as job {job.id}"
+                current_app.logger.info(msg)
+                flash(msg, "success")
+                return render_template("upload.html", job=job.id)
+
+            classes: dict[str, int] = {}
+            stats = FrameStats()
+            try:
+                count = get_telemetry(path, classes=classes, stats=stats)
+            finally:
+                os.remove(path)
 
             msg = f"The file '{file.filename}' has been successfully uploaded"
             current_app.logger.info(msg)
             flash(msg, "success")
             flash(f"Read {count} packets", "info")
+            flash(
+                "Packets by class: "
+                + ", ".join(f"{name} {num}" for name, num in classes.items()),
+                "info",
+            )
+            if stats.skipped_bytes:
+                flash(
+                    f"Skipped {stats.skipped_bytes} bytes "
+                    f"({stats.skipped_frames} frames) of damaged trace regions",
+                    "error",
+                )
             current_app.logger.info(f"Added {count} packets to the database")
 
         else:
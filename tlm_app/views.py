@@ -4,13 +4,29 @@ Application factory, configuration and URL description
 
 import os
 from datetime import datetime
-from flask import Flask, render_template, abort, send_file, redirect
+from flask import Flask, render_template, abort, redirect, jsonify, request
+from flask import send_from_directory, stream_template, stream_with_context
 from flask.logging import create_logger
 from werkzeug import Response
-from .database import db, init_db
+from . import ltu_db
+from .database import db, init_db, init_engine
 from .upload import upload_file
+from .jobs import JobQueue
+from .cache import DataGeneration, ResultCache
+from .render import Renderer
 from .subsets import validate_request
-from .plot import collect_data, collect_for_plot, plot_telemetry, view_routes
+from .plot import channel_id_by_name, collect_columns, collect_series, view_routes
+from .plot import PLOT_POINTS, render_options
+from .decimate import DECIMATORS, decimate
+from .api import SERIES_FORMATS, TIME_COLUMN, series_binary, series_json
+from .api import time_window, window_bound
+from .export import MIMETYPES, csv_chunks, export_batches, export_channels
+from .export import export_columns, parquet_available, parquet_chunks
+from .export import validate_export
+from .pages import decode_cursor, table_page, table_rows
+from .store import set_columns
+from .plot_cache import PLOT_MAX_AGE, fetch_plot, plot_filename
+from .timestamp import BEIJING_TIME
 
 
 def create_app(test_config=None) -> Flask:
@@ -28,9 +44,83 @@ def create_app(test_config=None) -> Flask:
         SQLALCHEMY_DATABASE_URI="sqlite:///"
         + os.path.join(app.instance_path, "ltu-tel.sqlite"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # keep uploaded traces in the instance folder while they are read
+        UPLOAD_FOLDER=os.path.join(app.instance_path, "uploads"),
+        # decode traces packet by packet ("packet") or all at once ("numpy")
+        TLM_DECODER="packet",
+        # decode traces in several processes, each one taking ranges of
+        # TLM_INGEST_CHUNK packets (the "packet" decoder is used then)
+        TLM_INGEST_WORKERS=1,
+        TLM_INGEST_CHUNK=65536,
+        # ingest uploads in a background thread and report them as jobs
+        TLM_ASYNC_INGEST=True,
+        # store CU times and routes as datetimes ("datetime") or as integer
+        # Unix times in nanoseconds ("epoch_ns"), which are converted
+        # in bulk when plotting
+        TLM_TIME_STORAGE="datetime",
+        # store telemetry values scaled to physical units ("calibrated") or
+        # as raw ADC counts ("counts"), which take less space and are scaled
+        # when read, so that corrected units and RT adjustments apply to
+        # the stored traces
+        TLM_VALUE_STORAGE="calibrated",
+        # insert decoded rows and commit them in batches of this size
+        TLM_INSERT_BATCH=10000,
+        # replace the stored telemetry with each trace ("replace") or add
+        # the packets not stored yet ("append")
+        TLM_INGEST_MODE="replace",
+        # keep every route, channel and column in a memory-mapped file as
+        # well, so that plots and the series API read only the columns of a set
+        TLM_COLUMNAR=False,
+        TLM_COLUMNAR_FOLDER=os.path.join(app.instance_path, "columns"),
+        # keep min, max and mean of the values per time bucket of these
+        # lengths in seconds, plots of long routes are drawn from them
+        TLM_ROLLUP_LEVELS=(1, 10, 60, 600),
+        # store telemetry with SQLAlchemy ("sqlalchemy") or with the sqlite3
+        # module directly ("sqlite"), both in the same table, or with the
+        # sqlite3 module in a database file per route ("partitioned")
+        TLM_STORE="sqlalchemy",
+        TLM_PARTITION_FOLDER=os.path.join(app.instance_path, "partitions"),
+        # keep table and plot data read since the last change of the stored
+        # telemetry in memory, up to this size in bytes
+        TLM_CACHE_BYTES=128 << 20,
+        # keep rendered plots in this folder, up to this size in bytes
+        TLM_PLOT_FOLDER=os.path.join(app.instance_path, "plots"),
+        TLM_PLOT_CACHE_BYTES=64 << 20,
+        # render plots in this many worker processes, with at most
+        # TLM_RENDER_QUEUE renders waiting for them, or in the request
+        # thread if there are no workers
+        TLM_RENDER_WORKERS=0,
+        TLM_RENDER_QUEUE=8,
+        # reduce long series to a few points per pixel before plotting,
+        # keeping the minimum and maximum of every pixel ("minmax"), with
+        # Largest-Triangle-Three-Buckets ("lttb") or not at all ("none");
+        # the "decimate" request argument overrides it
+        TLM_DECIMATION="minmax",
+        # show the data table in pages of this many rows, or stream every
+        # row of the route with the "stream" request argument, querying
+        # pages of this size while the table is sent
+        TLM_TABLE_PAGE_ROWS=1000,
+        # export telemetry fetched in batches of this many rows, each one
+        # sent as a CSV chunk or a Parquet row group once it is written
+        TLM_EXPORT_BATCH_ROWS=10000,
+        # SQLite settings of every connection: readers are not blocked
+        # by the writer in the WAL mode
+        TLM_SQLITE_PRAGMAS={
+            "journal_mode": "wal",
+            "synchronous": "normal",
+            "mmap_size": 1 << 28,
+            "cache_size": -65536,
+            "temp_store": "memory",
+        },
+        # SQLite settings of the connection ingesting a trace
+        TLM_SQLITE_BULK_PRAGMAS={
+            "synchronous": "off",
+            "cache_size": -262144,
+        },
     )
 
     db.init_app(app)
+    ltu_db.init_app(app)
 
     if test_config is None:
         # load the instance config, if it exists, when not testing
@@ -47,8 +137,17 @@ def create_app(test_config=None) -> Flask:
 
     # Create the database
     with app.app_context():
+        init_engine(app)
         init_db()
 
+    app.extensions["tlm_jobs"] = JobQueue(app)
+    app.extensions["tlm_cache"] = ResultCache(
+        app.config["TLM_CACHE_BYTES"], DataGeneration()
+    )
+    app.extensions["tlm_renderer"] = Renderer(
+        app.config["TLM_RENDER_WORKERS"], app.config["TLM_RENDER_QUEUE"]
+    )
+
     @app.route("/")
     def tlm(name=None) -> str:
         return render_template("base.html", name=name, route=view_routes())
@@ -58,66 +157,195 @@ def create_app(test_config=None) -> Flask:
         app.logger.info("Uploading the file")
         return upload_file()
 
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id: str) -> Response:
+        job = app.extensions["tlm_jobs"].get(job_id)
+        if job is None:
+            abort(404, f"No such job '{job_id}'")
+        return jsonify(job.as_dict())
+
     @app.template_filter("fmt")
     def represent_float(float_data: float) -> str:
         return f"{float_data:.3f}"
 
+    @app.template_filter("cutime")
+    def represent_cutime(cutime: datetime | int) -> str:
+        if isinstance(cutime, int):
+            cutime = datetime.fromtimestamp(cutime / 1e9, BEIJING_TIME).replace(
+                tzinfo=None
+            )
+        return str(cutime)
+
     # pylint: disable=logging-fstring-interpolation
 
     @app.route("/table")
-    def view_table() -> str:
+    def view_table() -> str | Response:
         try:
             tlm_set, channel, route_time = validate_request()
             route_date = datetime.fromtimestamp(route_time)
+            before = request.args.get("before")
+            value = before or request.args.get("after")
+            cursor = decode_cursor(value) if value else None
+            channel_id = channel_id_by_name(channel)
         except ValueError as err:
             app.logger.error(str(err))
             abort(400, str(err))
             return ''
 
         # noinspection PyUnboundLocalVariable
-        rows, columns = collect_data(tlm_set, channel, route_date)
-        app.logger.debug(
-            f"Collected {len(rows)} rows, {len(columns)} columns, "
-            f"route date {route_date}"
-        )
+        limit = app.config["TLM_TABLE_PAGE_ROWS"]
         app.logger.info(
             f"Building data table for the route time {route_date}, "
             f"{channel} channel and {tlm_set.upper()} set"
         )
 
+        context = {
+            "table": channel,
+            "set": tlm_set,
+            "route": route_date,
+            "time": route_time,
+        }
+        if request.args.get("stream"):
+            # Rows are queried and rendered a page at a time as they are sent
+            rows = table_rows(tlm_set, channel_id, route_time, limit)
+            return Response(
+                stream_template(
+                    "table.html", rows=rows, columns=set_columns(tlm_set), **context
+                )
+            )
+
+        page = table_page(
+            tlm_set, channel_id, route_time, cursor, bool(before), limit
+        )
+        app.logger.debug(
+            f"Collected {len(page.rows)} rows, {len(page.columns)} columns, "
+            f"route date {route_date}"
+        )
+
         return render_template(
             "table.html",
-            table=channel,
-            rows=rows,
-            columns=columns,
-            set=tlm_set,
-            route=route_date,
-            time=route_time,
+            rows=page.rows,
+            columns=page.columns,
+            previous_page=page.previous,
+            next_page=page.next,
+            **context,
+        )
+
+    @app.route("/export")
+    def export_telemetry() -> Response:
+        try:
+            tlm_set, channel, route_time, export_format = validate_export()
+            channels = export_channels(channel)
+        except ValueError as err:
+            app.logger.error(str(err))
+            abort(400, str(err))
+
+        # noinspection PyUnboundLocalVariable
+        if route_time not in [x[0] for x in view_routes()]:
+            abort(404, f"No such route '{route_time}'")
+        if export_format == "parquet" and not parquet_available():
+            abort(501, "Parquet export needs pyarrow")
+
+        columns = export_columns(tlm_set)
+        batches = export_batches(
+            channels, columns, route_time, app.config["TLM_EXPORT_BATCH_ROWS"]
+        )
+        if export_format == "csv":
+            chunks = csv_chunks(columns, batches)
+        else:
+            chunks = parquet_chunks(columns, batches)
+
+        parts = [str(route_time)]
+        if channel is not None and tlm_set is not None:
+            parts += [channel, tlm_set]
+        filename = "_".join(["ltu", *parts]) + "." + export_format
+        app.logger.info(f"Exporting {filename}")
+
+        # The connection is held by the chunks until they are sent
+        return Response(
+            stream_with_context(chunks),
+            mimetype=MIMETYPES[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
 
+    @app.route("/api/series")
+    def api_series() -> Response:
+        try:
+            tlm_set, channel, route_time = validate_request()
+            start = window_bound(request.args.get("start"))
+            end = window_bound(request.args.get("end"))
+            series_format = request.args.get("format", "json")
+            if series_format not in SERIES_FORMATS:
+                msg = f"Unknown series format '{series_format}'"
+                raise ValueError(msg)
+            channel_id_by_name(channel)
+        except ValueError as err:
+            app.logger.error(str(err))
+            abort(400, str(err))
+
+        # noinspection PyUnboundLocalVariable
+        times, values, names = collect_columns(tlm_set, channel, route_time)
+        window = time_window(times, start, end)
+        header = {
+            "channel": channel,
+            "set": tlm_set,
+            "route": route_time,
+            "columns": [TIME_COLUMN] + names[1:],
+        }
+        times = times[window]
+        values = [x[window] for x in values]
+
+        if series_format == "binary":
+            return Response(
+                series_binary(header, times, values),
+                mimetype="application/octet-stream",
+            )
+        return jsonify(series_json(header, times, values))
+
     @app.route("/plot")
     def view_plot() -> str:
         try:
             tlm_set, channel, route_time = validate_request()
-            route_date = datetime.fromtimestamp(route_time)
+            decimation = request.args.get("decimate", app.config["TLM_DECIMATION"])
+            if decimation not in DECIMATORS:
+                msg = f"Unknown decimation '{decimation}'"
+                raise ValueError(msg)
+            channel_id_by_name(channel)
         except ValueError as err:
             app.logger.error(str(err))
             abort(400, str(err))
             return ''
 
+        def render(path: str) -> None:
+            params_list, columns, envelopes = collect_series(
+                tlm_set, channel, route_time
+            )
+            params_list, envelopes = decimate(
+                params_list, envelopes, decimation, PLOT_POINTS
+            )
+            app.logger.info(
+                f"Building the plot for the route date {route_time}, "
+                f"{channel} channel and {tlm_set.upper()} set"
+            )
+            app.extensions["tlm_renderer"].render(
+                path, params_list, columns, channel, envelopes
+            )
+
         # noinspection PyUnboundLocalVariable
-        rows, columns = collect_data(tlm_set, channel, route_date)
-        params_list = collect_for_plot(rows, columns)
-        app.logger.info(
-            f"Building the plot for the route date {route_time}, "
-            f"{channel} channel and {tlm_set.upper()} set"
+        filename = plot_filename(
+            tlm_set,
+            channel,
+            route_time,
+            app.extensions["tlm_cache"].refresh(),
+            decimation,
+            render_options(),
         )
-        filename = f"{channel.lower().replace('.', '_')}_{tlm_set}.png"
-        path = os.path.join(app.instance_path, "plots")
-        os.makedirs(path, exist_ok=True)
-        full_path = os.path.join(path, filename)
-        plot_telemetry(full_path, params_list, columns, channel)
-        app.logger.info(f"Saved {filename}")
+        folder = app.config["TLM_PLOT_FOLDER"]
+        max_bytes = app.config["TLM_PLOT_CACHE_BYTES"]
+        if fetch_plot(folder, filename, render, max_bytes):
+            app.logger.info(f"Reused {filename}")
+        else:
+            app.logger.info(f"Saved {filename}")
 
         return render_template(
             "plot.html",
@@ -126,8 +354,23 @@ def create_app(test_config=None) -> Flask:
 
     @app.route("/plot/<filename>")
     def show_plot(filename: str) -> Response:
-        full_path = os.path.join(app.instance_path, "plots", filename)
-        return send_file(full_path, mimetype="image/png")
+        # Images are content-addressed, so their names are their entity tags
+        etag = os.path.splitext(filename)[0]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        else:
+            response = send_from_directory(
+                app.config["TLM_PLOT_FOLDER"],
+                filename,
+                mimetype="image/png",
+                etag=etag,
+                max_age=PLOT_MAX_AGE,
+            )
+        response.cache_control.public = True
+        response.cache_control.max_age = PLOT_MAX_AGE
+        response.cache_control.immutable = True
+        return response
 
     @app.route("/plot/<image>")
     def open_image(filename: str) -> Response: